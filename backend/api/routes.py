@@ -1,21 +1,31 @@
 # backend/api/routes.py (最终完整版)
 
-from fastapi import APIRouter, HTTPException, Depends, Request, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, UploadFile, File, Form, BackgroundTasks
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from backend.config.config import BASE_DIR
 from backend.services.model_adapters import resolve_model_alias 
 import asyncio
+import json
 import os
+import uuid
+import hashlib
 import datetime
 
 # 导入我们重构后的模块
 from backend.services.report_generator import (
     generate_structured_report, 
     convert_report_to_markdown,
-    generate_chat_stream
+    generate_chat_stream,
+    serialize_report_event
 )
-from backend.services.report_graph import graph as report_graph
+from backend.services.report_graph import make_thread_id, thread_config
+from backend.services.singleflight import InFlightRun, report_runs
+from backend.services import metrics
+from backend.services import run_leases
+from backend.services import speculation
+from backend.services.prompt_cache import cached_token_ratios
+from backend.services import chat_session as chat_session_service
 from backend.schemas import report_schemas
 from backend.config.config import settings
 from backend.database import models
@@ -32,47 +42,146 @@ def get_db():
 
 router = APIRouter()
 
-@router.post("/api/reports/generate-mixed")
-async def generate_mixed_reports(request: dict):
+def _initial_state(topic: str, model_name: str, template_content: str | None, stream_report: bool = False) -> dict:
+    return {
+        "original_topic": topic,
+        "model_name": model_name,
+        "template_content": template_content,
+        "stream_report": stream_report,
+    }
+
+
+def _coalesce_key(topic: str, template_content: str | None, model_name: str) -> str:
+    """相同的 (规范化主题, 模板哈希, 模型) 视为同一请求，可以合并到一次运行。"""
+    normalized_topic = " ".join(topic.split()).casefold()
+    template_hash = hashlib.sha256(template_content.encode("utf-8")).hexdigest() if template_content else "-"
+    return f"{model_name}|{template_hash}|{normalized_topic}"
+
+
+async def _drive_graph(report_graph, run: InFlightRun, graph_input, config: dict):
+    """运行 (或从检查点恢复) 图，把 custom 流中的增量事件发布给所有订阅者，返回最终状态。"""
+    final_state = None
+    async for mode, chunk in report_graph.astream(graph_input, config, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            await run.publish(serialize_report_event(chunk))
+        else:
+            final_state = chunk
+    return final_state
+
+
+def _start_model_runs(app, run_id: str, topic: str, template_content: str | None,
+                      stream_report: bool = False) -> dict[str, InFlightRun]:
     """
-    混合模式 (无模板): 并行运行LangGraph工作流来生成报告。
+    为每个模型启动工作流；若已有相同主题/模板/模型的运行正在进行，则直接挂到那次运行上。
+    返回 {model_name: InFlightRun}。
     """
-    topic = request.get("topic")
-    if not topic:
-        raise HTTPException(status_code=400, detail="Topic is required.")
-
-    # 统一调用图，但不传入 template_content
-    tasks = []
+    report_graph = app.state.report_graph
+    runs = {}
     for model_name in settings.MIXED_MODE_MODELS:
-        initial_state = {
-            "original_topic": topic,
-            "model_name": model_name,
-            "template_content": None,
-            "sentence_model": request.app.state.sentence_model,
-            "reports_collection": request.app.state.reports_collection,
-            "knowledge_collection": request.app.state.knowledge_collection
-        }
-        tasks.append(report_graph.ainvoke(initial_state))
-
-    final_states = await asyncio.gather(*tasks, return_exceptions=True)
-
-    # 后续处理结果的逻辑是完全一致的，可以复用
+        thread_id = make_thread_id(run_id, model_name)
+        initial_state = _initial_state(topic, model_name, template_content, stream_report)
+
+        async def runner(run, initial_state=initial_state, thread_id=thread_id):
+            metrics.increment("report_runs_started")
+            # 命中推测式预热时，图会跳过主题扩展和检索两个节点
+            prewarmed = await speculation.take_prewarmed(initial_state["original_topic"], initial_state["model_name"])
+            if prewarmed:
+                initial_state = {**initial_state, **prewarmed}
+            async with run_leases.hold(thread_id):
+                return await _drive_graph(report_graph, run, initial_state, thread_config(thread_id))
+
+        runs[model_name], _ = report_runs.get_or_start(
+            _coalesce_key(topic, template_content, model_name), thread_id, runner
+        )
+    return runs
+
+
+def _create_report_run(db: Session, run_id: str, topic: str, runs: dict[str, InFlightRun]):
+    """登记一次混合模式运行，之后可以按 run_id 从检查点重试失败的模型。"""
+    model_threads = {model_name: run.thread_id for model_name, run in runs.items()}
+    db.add(models.DbReportRun(id=run_id, original_topic=topic, model_threads=json.dumps(model_threads)))
+    db.commit()
+
+
+def _failed_report_content(error) -> str:
+    return f"# 工作流执行失败\n\n**错误详情:**\n```\n{error}\n```"
+
+
+def _collect_final_reports(final_states, model_names) -> list[dict]:
     final_reports = []
-    for result_state, model_name in zip(final_states, settings.MIXED_MODE_MODELS):
+    for result_state, model_name in zip(final_states, model_names):
         if isinstance(result_state, dict) and result_state.get("final_report"):
             report_obj = result_state["final_report"]
             final_reports.append({
                 "model_name": model_name,
+                "status": "done",
                 "content": convert_report_to_markdown(report_obj)
             })
         else:
             print(f"❌ 模型 {model_name} 的工作流执行失败: {result_state}")
             final_reports.append({
                 "model_name": model_name,
-                "content": f"# 工作流执行失败\n\n**错误详情:**\n```\n{result_state}\n```"
+                "status": "error",
+                "content": _failed_report_content(result_state)
             })
-    
-    return {"reports": final_reports}
+    return final_reports
+
+
+async def _await_unless_disconnected(request: Request, awaitable):
+    """
+    等待结果，同时定期检查客户端是否已经断开。
+    断开时取消等待并返回 None，调用方据此释放 (并在无人订阅时取消) 仍在进行的运行。
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=settings.DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.increment("client_disconnects")
+                print("客户端已断开，停止等待生成结果。")
+                return None
+    finally:
+        task.cancel()
+
+
+async def _run_mixed_reports(request: Request, db: Session, topic: str, template_content: str | None) -> dict | None:
+    """
+    并行运行所有模型的工作流；每个模型的进度都会写入检查点，失败后可按 run_id 重试。
+    客户端中途断开时返回 None。
+    """
+    run_id = uuid.uuid4().hex
+    runs = _start_model_runs(request.app, run_id, topic, template_content)
+    try:
+        _create_report_run(db, run_id, topic, runs)
+        final_states = await _await_unless_disconnected(
+            request, asyncio.gather(*(run.wait() for run in runs.values()), return_exceptions=True)
+        )
+    finally:
+        for run in runs.values():
+            report_runs.release(run)
+    if final_states is None:
+        return None
+    return {"run_id": run_id, "reports": _collect_final_reports(final_states, list(runs))}
+
+
+def _client_closed_response() -> Response:
+    # 499: 客户端在服务端返回前关闭了连接 (沿用 nginx 的约定)
+    return Response(status_code=499)
+
+
+@router.post("/api/reports/generate-mixed")
+async def generate_mixed_reports(request_data: report_schemas.TopicRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    混合模式 (无模板): 并行运行LangGraph工作流来生成报告。
+    """
+    if not request_data.topic:
+        raise HTTPException(status_code=400, detail="Topic is required.")
+
+    # 统一调用图，但不传入 template_content
+    result = await _run_mixed_reports(request, db, request_data.topic, None)
+    return result if result is not None else _client_closed_response()
 
 
 @router.post("/api/reports/generate-from-template")
@@ -93,37 +202,175 @@ async def generate_from_template(
         raise HTTPException(status_code=400, detail="无法解析模板文件或文件为空。")
     
     # 统一调用图，并传入解析后的 template_content
-    tasks = []
-    for model_name in settings.MIXED_MODE_MODELS:
-        initial_state = {
-            "original_topic": topic,
-            "model_name": model_name,
-            "template_content": template_content, # <--- 传入模板内容
-            "sentence_model": request.app.state.sentence_model,
-            "reports_collection": request.app.state.reports_collection,
-            "knowledge_collection": request.app.state.knowledge_collection
-        }
-        tasks.append(report_graph.ainvoke(initial_state))
-
-    # 并行执行和后续处理逻辑与上面完全相同
-    final_states = await asyncio.gather(*tasks, return_exceptions=True)
-    
-    final_reports = []
-    for result_state, model_name in zip(final_states, settings.MIXED_MODE_MODELS):
-        if isinstance(result_state, dict) and result_state.get("final_report"):
-            report_obj = result_state["final_report"]
-            final_reports.append({
+    result = await _run_mixed_reports(request, db, topic, template_content)
+    return result if result is not None else _client_closed_response()
+
+
+@router.post("/api/reports/runs/{run_id}/retry")
+async def retry_report_run(run_id: str, request: Request, db: Session = Depends(get_db)):
+    """
+    重试一次混合模式运行中失败的模型：已成功的模型直接复用检查点中的报告，
+    失败的模型从最后完成的节点继续 (复用已保存的主题扩展和检索结果)。
+    """
+    run_record = db.query(models.DbReportRun).filter(models.DbReportRun.id == run_id).first()
+    if not run_record:
+        raise HTTPException(status_code=404, detail="运行记录未找到")
+
+    model_threads = json.loads(run_record.model_threads)
+    report_graph = request.app.state.report_graph
+
+    async def resume(model_name: str, thread_id: str):
+        # 该线程仍在本进程中执行 (原始运行或另一次重试) 时直接等待它，不能在同一检查点上再启动一次
+        run = report_runs.attach(thread_id)
+        if run is None:
+            config = thread_config(thread_id)
+
+            async def runner(run):
+                # 持有线程租约后再读取检查点：该线程仍在其他工作进程中执行时，会在这里等它结束
+                async with run_leases.hold(thread_id):
+                    snapshot = await report_graph.aget_state(config)
+                    if not snapshot.values:
+                        raise ValueError("未找到该模型的检查点，无法重试。")
+                    if snapshot.values.get("final_report") and not snapshot.next:
+                        print(f"模型 {model_name} 已成功完成，复用检查点中的报告。")
+                        return snapshot.values
+                    print(f"模型 {model_name} 从节点 {list(snapshot.next)} 继续执行...")
+                    return await _drive_graph(report_graph, run, None, config)
+
+            # 同一线程的并发重试也只执行一次
+            run, _ = report_runs.get_or_start(f"retry|{thread_id}", thread_id, runner)
+        try:
+            return await run.wait()
+        finally:
+            report_runs.release(run)
+
+    final_states = await _await_unless_disconnected(request, asyncio.gather(
+        *(resume(model_name, thread_id) for model_name, thread_id in model_threads.items()),
+        return_exceptions=True
+    ))
+    if final_states is None:
+        return _client_closed_response()
+    return {"run_id": run_id, "reports": _collect_final_reports(final_states, list(model_threads))}
+
+
+def _sse(payload: dict) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream_mixed_reports(run_id: str, runs: dict[str, InFlightRun]):
+    """
+    订阅各模型的运行，并把增量报告事件合并成一个SSE流。
+    每条事件都带有 model_name；模型结束时发送 done (含完整Markdown) 或 error 事件。
+    挂到阻塞请求发起的运行上时没有增量事件，只会收到最终的 done/error。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def follow(model_name: str, run: InFlightRun):
+        try:
+            async for event in run.subscribe():
+                await queue.put({"model_name": model_name, **event})
+            final_state = await run.wait()
+            if not final_state or not final_state.get("final_report"):
+                raise ValueError("工作流结束时没有生成最终报告。")
+            await queue.put({
                 "model_name": model_name,
-                "content": convert_report_to_markdown(report_obj)
+                "event": "done",
+                "content": convert_report_to_markdown(final_state["final_report"])
             })
-        else:
-            print(f"❌ 模型 {model_name} 的工作流执行失败: {result_state}")
-            final_reports.append({
+        except Exception as e:
+            print(f"❌ 模型 {model_name} 的流式工作流执行失败: {e}")
+            await queue.put({
                 "model_name": model_name,
-                "content": f"# 工作流执行失败\n\n**错误详情:**\n```\n{result_state}\n```"
+                "event": "error",
+                "content": _failed_report_content(e)
             })
-            
-    return {"reports": final_reports}
+
+    tasks = [asyncio.create_task(follow(model_name, run)) for model_name, run in runs.items()]
+    finished = 0
+    try:
+        yield _sse({"event": "start", "run_id": run_id, "models": list(runs)})
+        while finished < len(tasks):
+            item = await queue.get()
+            if item["event"] in ("done", "error"):
+                finished += 1
+            yield _sse(item)
+    finally:
+        # 客户端断开时流会被取消，这里释放订阅，无人订阅的运行随之取消
+        if finished < len(tasks):
+            metrics.increment("client_disconnects")
+            print(f"客户端已断开，释放运行 {run_id} 的订阅。")
+        for task in tasks:
+            task.cancel()
+        for run in runs.values():
+            report_runs.release(run)
+
+
+def _start_stream_response(app, db: Session, topic: str, template_content: str | None) -> StreamingResponse:
+    run_id = uuid.uuid4().hex
+    runs = _start_model_runs(app, run_id, topic, template_content, stream_report=True)
+    try:
+        _create_report_run(db, run_id, topic, runs)
+    except Exception:
+        # 负责释放订阅的流还没有创建，这里必须自行释放，否则这些运行永远不会因断开而被取消
+        for run in runs.values():
+            report_runs.release(run)
+        raise
+    return StreamingResponse(_stream_mixed_reports(run_id, runs), media_type="text/event-stream")
+
+
+@router.post("/api/reports/generate-mixed/stream")
+async def generate_mixed_reports_stream(request_data: report_schemas.TopicRequest, request: Request, db: Session = Depends(get_db)):
+    """
+    混合模式 (无模板) 的流式版本: 每个模型的标题、引言和章节一旦生成完毕就立即推送。
+    """
+    if not request_data.topic:
+        raise HTTPException(status_code=400, detail="Topic is required.")
+    return _start_stream_response(request.app, db, request_data.topic, None)
+
+
+@router.post("/api/reports/generate-from-template/stream")
+async def generate_from_template_stream(
+    request: Request,
+    db: Session = Depends(get_db),
+    topic: str = Form(...),
+    template_file: UploadFile = File(...)
+):
+    """
+    混合模式 (有模板) 的流式版本。
+    """
+    if not template_file.filename.endswith('.docx'):
+        raise HTTPException(status_code=400, detail="模板文件必须是 .docx 格式。")
+
+    template_content = await parse_docx_template(template_file)
+    if not template_content:
+        raise HTTPException(status_code=400, detail="无法解析模板文件或文件为空。")
+
+    return _start_stream_response(request.app, db, topic, template_content)
+
+
+@router.get("/api/metrics")
+def get_metrics():
+    """进程内的运行指标 (如被合并的重复请求数、预热命中率、各模型的提示词缓存命中比例)。"""
+    snapshot = metrics.snapshot()
+    snapshot["speculation_hit_rate"] = speculation.hit_rate(snapshot)
+    snapshot["cached_token_ratio"] = cached_token_ratios(snapshot)
+    return snapshot
+
+
+async def _cancellable_stream(stream_generator):
+    """
+    转发模型的流式输出。客户端断开时 StreamingResponse 会取消本生成器，
+    这里显式关闭上游生成器，使仍在进行的模型流式请求立即中止。
+    """
+    try:
+        async for chunk in stream_generator:
+            yield chunk
+    except (asyncio.CancelledError, GeneratorExit):
+        metrics.increment("chat_streams_cancelled")
+        print("客户端已断开，中止模型的流式输出。")
+        raise
+    finally:
+        await stream_generator.aclose()
 
 
 @router.post("/api/chat/completions")
@@ -138,13 +385,111 @@ async def chat_completions(request: report_schemas.ChatRequest):
         messages=request.dict()['messages'], 
         model_name=actual_model_name
     )
-    async def event_stream():
-        async for chunk in stream_generator:
-            yield chunk
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    return StreamingResponse(_cancellable_stream(stream_generator), media_type="text/event-stream")
+
 
 
 
+@router.post("/api/chat/sessions")
+def create_chat_session(request_data: report_schemas.ChatSessionCreateRequest, db: Session = Depends(get_db)):
+    """创建服务端对话会话，之后客户端每轮只需发送新消息。"""
+    actual_model_name = resolve_model_alias(request_data.model)
+    if not actual_model_name:
+        raise HTTPException(status_code=400, detail=f"未知的模型简称 '{request_data.model}'。")
+    chat_session = chat_session_service.create_session(db, actual_model_name)
+    print(f"已创建对话会话: {chat_session.id} (模型: {actual_model_name})")
+    return {"session_id": chat_session.id}
+
+
+@router.get("/api/chat/sessions/{session_id}", response_model=report_schemas.ChatSessionInfo)
+def get_chat_session(session_id: str, db: Session = Depends(get_db)):
+    chat_session = chat_session_service.get_session(db, session_id)
+    if not chat_session:
+        raise HTTPException(status_code=404, detail="对话会话未找到")
+    messages = chat_session_service.get_session_messages(db, session_id)
+    return {
+        "session_id": chat_session.id,
+        "model": chat_session.model_name,
+        "summary": chat_session.summary or "",
+        "messages": [{"role": m.role, "content": m.content} for m in messages],
+    }
+
+
+@router.delete("/api/chat/sessions/{session_id}", status_code=204)
+def delete_chat_session(session_id: str, request: Request, db: Session = Depends(get_db)):
+    if not chat_session_service.get_session(db, session_id):
+        raise HTTPException(status_code=404, detail="对话会话未找到")
+    chat_session_service.delete_session(db, session_id, request.app.state.chat_history_collection)
+    print(f"已删除对话会话: {session_id}")
+    return
+
+
+@router.post("/api/chat/sessions/{session_id}/messages")
+async def chat_session_message(
+    session_id: str,
+    request_data: report_schemas.ChatSessionMessageRequest,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """
+    向服务端会话发送一条新消息。模型只看到 滚动摘要 + token预算内的最近轮次，
+    因此每轮的提示词长度不随对话变长而增长。
+    """
+    chat_session = chat_session_service.get_session(db, session_id)
+    if not chat_session:
+        raise HTTPException(status_code=404, detail="对话会话未找到")
+
+    model_name = chat_session.model_name
+    if request_data.model:
+        model_name = resolve_model_alias(request_data.model)
+        if not model_name:
+            raise HTTPException(status_code=400, detail=f"未知的模型简称 '{request_data.model}'。")
+
+    if any(message.role not in ("user", "assistant") for message in request_data.history):
+        raise HTTPException(status_code=400, detail="history 中的消息角色只能是 user 或 assistant。")
+
+    sentence_model = request.app.state.sentence_model
+    history_collection = request.app.state.chat_history_collection
+    for message in request_data.history:
+        await chat_session_service.append_message(
+            db, session_id, message.role, message.content, sentence_model, history_collection
+        )
+    user_message = await chat_session_service.append_message(
+        db, session_id, "user", request_data.content, sentence_model, history_collection
+    )
+    messages, needs_compaction = await chat_session_service.build_session_context(
+        db, chat_session, sentence_model, history_collection
+    )
+    if needs_compaction:
+        chat_session_service.schedule_summary_refresh(session_id)
+
+    async def event_stream():
+        reply_chunks, completed = [], False
+        try:
+            stream_generator = generate_chat_stream(messages=messages, model_name=model_name, raise_errors=True)
+            async for chunk in _cancellable_stream(stream_generator):
+                reply_chunks.append(chunk)
+                yield chunk
+            completed = True
+        except Exception as e:
+            # 错误提示只发给客户端，不作为回复写入会话历史
+            yield f"抱歉，处理您的请求时出现错误: {e}"
+        finally:
+            # 使用独立的数据库会话 (请求作用域的会话此时可能已关闭)
+            reply_db = SessionLocal()
+            try:
+                if completed:
+                    await chat_session_service.append_message(
+                        reply_db, session_id, "assistant", "".join(reply_chunks), sentence_model, history_collection
+                    )
+                else:
+                    # 生成失败或客户端断开：删除没有回复的用户消息，避免历史中出现连续两条用户消息
+                    chat_session_service.delete_message(reply_db, user_message, history_collection)
+            finally:
+                reply_db.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 # backend/api/routes.py
 
 @router.post("/api/save-report")
@@ -178,14 +523,14 @@ def save_report(request_data: report_schemas.SaveRequest, request: Request, db:
     try:
         print("正在为新报告创建向量...")
         sentence_model = request.app.state.sentence_model
-        collection = request.app.state.collection
+        collection = request.app.state.reports_collection
         embedding = sentence_model.encode(request_data.topic).tolist()
         collection.add(
             embeddings=[embedding],
             metadatas=[{"theme": db_report.theme, "model_name": request_data.model_name}],
             ids=[str(db_report.id)]
         )
-        print(f"向量已存入ChromaDB，ID: {db_report.id}")
+        print(f"向量已存入报告索引，ID: {db_report.id}")
     except Exception as e:
         print(f"❌ 存入向量数据库时发生错误: {e}")
 
@@ -223,9 +568,17 @@ def get_report_content(report_id: int, db: Session = Depends(get_db)):
     
 
 @router.post("/api/find-similar", response_model=list[report_schemas.ReportMetadata])
-def find_similar_reports(request_data: report_schemas.TopicRequest, request: Request, db: Session = Depends(get_db)):
+def find_similar_reports(
+    request_data: report_schemas.FindSimilarRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db)
+):
     """根据主题查找相似的历史报告"""
     print(f"收到相似度搜索请求，主题: '{request_data.topic}'")
+    # 混合模式下用户通常随后就会点击生成，开启推测式预热时在响应返回后提前执行扩展和检索
+    if request_data.prewarm:
+        background_tasks.add_task(speculation.start_prewarm, request_data.topic)
     collection = request.app.state.reports_collection
     if collection.count() == 0:
         print("向量数据库为空，无需搜索。")
@@ -266,7 +619,7 @@ def delete_report(report_id: int, request: Request, db: Session = Depends(get_db
 
     # 2. 从向量数据库删除向量
     try:
-        collection = request.app.state.collection
+        collection = request.app.state.reports_collection
         collection.delete(ids=[str(report_id)])
         print(f"已从向量数据库删除ID: {report_id}")
     except Exception as e:
@@ -301,7 +654,7 @@ def delete_theme(theme_name: str, request: Request, db: Session = Depends(get_db
 
     # 2. 批量从向量数据库删除
     try:
-        collection = request.app.state.collection
+        collection = request.app.state.reports_collection
         collection.delete(ids=report_ids_to_delete)
         print(f"已从向量数据库删除IDs: {report_ids_to_delete}")
     except Exception as e:
@@ -20,6 +20,32 @@ class Settings(BaseSettings):
     ]
     # ^^^^                                       ^^^^
 
+    # 报告相似度检索的向量索引后端: "chroma" (默认) 或 "mmap" (进程内内存映射索引)
+    REPORT_INDEX_BACKEND: str = "chroma"
+    REPORT_INDEX_COMPACT_RATIO: float = 0.2
+
+    # 阻塞式生成接口检测客户端断开的轮询间隔 (秒)
+    DISCONNECT_POLL_INTERVAL: float = 1.0
+
+    # 检查点线程的运行租约 (秒)：执行中每 TTL/3 续约一次，进程崩溃后租约过期，其他进程才能恢复该线程
+    RUN_LEASE_TTL: float = 30.0
+    RUN_LEASE_POLL_INTERVAL: float = 1.0
+    # 混合模式运行记录及其检查点的保留天数，启动时清理更早的记录 (0 表示不清理)
+    REPORT_RUN_RETENTION_DAYS: int = 7
+
+    # 推测式预热 (默认关闭)：find-similar 时在后台提前执行主题扩展和知识检索，生成时命中则直接复用
+    SPECULATIVE_PREWARM: bool = False
+    SPECULATIVE_CACHE_TTL: float = 120.0
+    SPECULATIVE_MAX_CONCURRENCY: int = 2
+
+    # 服务端对话会话：最近轮次窗口的token预算，窗口之外的历史累计超过阈值后异步压缩进滚动摘要
+    CHAT_WINDOW_TOKEN_BUDGET: int = 3000
+    CHAT_WINDOW_MAX_MESSAGES: int = 50
+    CHAT_SUMMARY_TRIGGER_TOKENS: int = 1000
+    # 可选：按向量相似度召回窗口之外的旧对话
+    CHAT_HISTORY_RETRIEVAL: bool = False
+    CHAT_RETRIEVAL_TOP_K: int = 3
+
 settings = Settings()
 
 
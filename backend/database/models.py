@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey
 from .connection import Base
 import datetime
 
@@ -9,4 +9,51 @@ class DbReport(Base):
     original_topic = Column(String)
     model_name = Column(String)
     saved_at = Column(DateTime, default=datetime.datetime.utcnow)
-    file_path = Column(String, unique=True)
\ No newline at end of file
+    file_path = Column(String, unique=True)
+
+
+class DbChatSession(Base):
+    __tablename__ = "chat_sessions"
+    id = Column(String, primary_key=True, index=True)
+    model_name = Column(String)
+    summary = Column(Text, default="")          # 窗口之外历史对话的滚动摘要
+    summarized_until = Column(Integer, default=0)  # 已并入摘要的最后一条消息ID
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class DbChatMessage(Base):
+    __tablename__ = "chat_messages"
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(String, ForeignKey("chat_sessions.id"), index=True)
+    role = Column(String)
+    content = Column(Text)
+    token_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+
+class DbReportRun(Base):
+    """一次混合模式生成请求，run_id 用于从检查点重试失败的模型"""
+    __tablename__ = "report_runs"
+    id = Column(String, primary_key=True, index=True)
+    original_topic = Column(String)
+    # JSON 对象 {model_name: thread_id}。被合并到其他进行中运行的模型，会指向那次运行的检查点线程
+    model_threads = Column(Text)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class DbThreadLease(Base):
+    """检查点线程的运行租约：执行中的进程定期续约，其他工作进程据此判断该线程是否仍在运行"""
+    __tablename__ = "thread_leases"
+    thread_id = Column(String, primary_key=True, index=True)
+    holder = Column(String)
+    expires_at = Column(DateTime)
+
+
+class DbSpeculation(Base):
+    """推测式预热的结果 (主题扩展和检索)，存放在共享数据库中，任意工作进程都可以取用"""
+    __tablename__ = "speculations"
+    key = Column(String, primary_key=True, index=True)
+    payload = Column(Text)  # JSON: {"expanded_queries": [...], "retrieved_context": "..."}
+    expires_at = Column(DateTime)
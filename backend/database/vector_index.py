@@ -0,0 +1,237 @@
+# backend/database/vector_index.py
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只能单进程使用
+    fcntl = None
+
+
+class MmapVectorIndex:
+    """
+    基于内存映射文件的进程内向量索引，用作报告相似度检索的轻量后端。
+
+    目录中包含三个只追加的文件：
+      vectors.f32     float32 向量矩阵 (行数 x 维度)
+      ids.i64         每一行对应的报告ID
+      tombstones.i64  删除记录 (报告ID, 删除时的总行数)，该ID在此之前写入的行都视为已删除
+    同一ID被多次写入时以最后一行为准；死行比例超过 compact_ratio 时重写文件进行压缩。
+    对外提供与 Chroma 集合相同的 count/add/query/delete 接口，可以直接替换 reports_collection。
+    向量写入和查询时都会做L2归一化，点积即余弦相似度。
+
+    多个工作进程可以共用同一目录：写入和压缩持有 .lock 上的排他文件锁 (fcntl.flock)，
+    每次操作前比较文件的 inode 和大小，发现其他进程改动过就重新加载。
+    没有 fcntl 的平台 (Windows) 上只能由单个进程使用。
+    """
+    QUERY_BATCH_ROWS = 65536  # 分批计算点积，限制单次查询的临时内存
+
+    def __init__(self, directory: Path, dim: int, compact_ratio: float = 0.2, compact_min_rows: int = 1024):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dim = dim
+        self.compact_ratio = compact_ratio
+        self.compact_min_rows = compact_min_rows
+        self._vectors_path = self.directory / "vectors.f32"
+        self._ids_path = self.directory / "ids.i64"
+        self._tombstones_path = self.directory / "tombstones.i64"
+        self._lock = threading.RLock()
+        self._lock_file = open(self.directory / ".lock", "a+b")
+        self._lock_depth = 0
+        self._signature = None
+        # 首次加载在排他锁下进行，此时才能安全地截断崩溃留下的残缺文件
+        with self._locked(exclusive=True):
+            pass
+
+    # --- 跨进程锁与加载 ---
+
+    @contextmanager
+    def _locked(self, exclusive: bool):
+        """持有进程内锁和文件锁 (可重入)；最外层加锁后先同步其他进程的改动。"""
+        with self._lock:
+            outermost = self._lock_depth == 0
+            if outermost and fcntl is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self._lock_depth += 1
+            try:
+                if outermost and self._file_signature() != self._signature:
+                    self._load()
+                yield
+            finally:
+                self._lock_depth -= 1
+                if outermost and fcntl is not None:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _file_signature(self):
+        # 追加会改变大小，压缩会用新文件替换 (inode 改变)
+        signature = []
+        for path in (self._ids_path, self._tombstones_path):
+            try:
+                stat = path.stat()
+                signature.append((stat.st_ino, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _load(self):
+        ids = np.fromfile(self._ids_path, dtype=np.int64) if self._ids_path.exists() else np.empty(0, np.int64)
+        vector_rows = self._vectors_path.stat().st_size // (4 * self.dim) if self._vectors_path.exists() else 0
+        # 写入中途崩溃时两个文件的行数可能不一致 (或最后一行不完整)，以较短者为准，
+        # 并把两个文件截断到该行数，否则之后追加的行会和多余的旧行错位。
+        # 写入方持有排他锁，持锁读到的不完整数据只可能来自崩溃的写入
+        rows = min(len(ids), vector_rows)
+        for path, row_bytes in ((self._vectors_path, 4 * self.dim), (self._ids_path, 8)):
+            if path.exists() and path.stat().st_size != rows * row_bytes:
+                os.truncate(path, rows * row_bytes)
+        self._ids = ids[:rows].copy()
+        self._map_vectors(rows)
+
+        tombstones = np.empty((0, 2), dtype=np.int64)
+        if self._tombstones_path.exists():
+            raw = np.fromfile(self._tombstones_path, dtype=np.int64)
+            if len(raw) % 2:
+                os.truncate(self._tombstones_path, (len(raw) - 1) * 8)
+            tombstones = raw[:len(raw) // 2 * 2].reshape(-1, 2)
+
+        # 同一ID被多次写入时只保留最后一次 (倒序去重，np.unique 返回首次出现的位置)
+        reversed_rows = np.arange(rows)[::-1]
+        _, first_in_reversed = np.unique(self._ids[reversed_rows], return_index=True)
+        self._alive = np.zeros(rows, dtype=bool)
+        self._alive[reversed_rows[first_in_reversed]] = True
+        if len(tombstones):
+            # 每个ID只看最晚的删除记录：删除之前写入的行已失效，之后重新写入的行仍然有效
+            tombstones = tombstones[np.lexsort((tombstones[:, 1], tombstones[:, 0]))]
+            latest = np.r_[tombstones[1:, 0] != tombstones[:-1, 0], True]
+            dead_ids, dead_before = tombstones[latest, 0], tombstones[latest, 1]
+            alive_rows = np.flatnonzero(self._alive)
+            position = np.minimum(np.searchsorted(dead_ids, self._ids[alive_rows]), len(dead_ids) - 1)
+            deleted = (dead_ids[position] == self._ids[alive_rows]) & (alive_rows < dead_before[position])
+            self._alive[alive_rows[deleted]] = False
+        self._row_of = {int(self._ids[row]): row for row in np.flatnonzero(self._alive)}
+        self._signature = self._file_signature()
+
+    def _map_vectors(self, rows: int):
+        self._vectors = None
+        if rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    # --- Chroma 兼容接口 ---
+
+    def count(self) -> int:
+        with self._locked(exclusive=False):
+            return len(self._row_of)
+
+    def add(self, embeddings, ids, metadatas=None, **_):
+        """追加向量。ids 必须是整数或整数字符串；metadatas 不会被保存 (元数据以SQL数据库为准)。"""
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        new_ids = np.asarray([int(i) for i in ids], dtype=np.int64)
+        with self._locked(exclusive=True):
+            # 覆盖写入同一ID时旧行自动失效 (加载时以最后一行为准)，这里只需更新内存中的状态
+            replaced = [self._row_of[int(i)] for i in new_ids if int(i) in self._row_of]
+            self._alive[replaced] = False
+
+            start = len(self._ids)
+            # 先写向量再写ID，保证任何时刻 ids 文件中的行都有完整的向量
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.astype(np.float32).tobytes())
+            with open(self._ids_path, "ab") as f:
+                f.write(new_ids.tobytes())
+
+            self._ids = np.concatenate([self._ids, new_ids])
+            self._alive = np.concatenate([self._alive, np.ones(len(new_ids), dtype=bool)])
+            for offset, report_id in enumerate(new_ids):
+                self._row_of[int(report_id)] = start + offset
+            self._map_vectors(len(self._ids))
+            self._signature = self._file_signature()
+
+    def upsert(self, embeddings, ids, metadatas=None, **_):
+        """add 本身就会覆盖同一ID的旧向量，与 Chroma 的 upsert 语义一致。"""
+        self.add(embeddings, ids, metadatas)
+
+    def write_lock(self):
+        """持有排他锁执行一组操作 (例如先检查索引是否为空再回填)，期间其他进程的读写会等待。"""
+        return self._locked(exclusive=True)
+
+    def delete(self, ids, **_):
+        with self._locked(exclusive=True):
+            dead_ids = [int(i) for i in ids if int(i) in self._row_of]
+            if dead_ids:
+                self._append_tombstones(dead_ids)
+            self.maybe_compact()
+
+    def query(self, query_embeddings, n_results: int = 10, **_) -> dict:
+        queries = self._normalize(np.asarray(query_embeddings, dtype=np.float32).reshape(-1, self.dim))
+        with self._locked(exclusive=False):
+            vectors, alive = self._vectors, self._alive
+            ids = self._ids
+        k = min(n_results, int(alive.sum())) if vectors is not None else 0
+        if k == 0:
+            return {"ids": [[] for _ in queries], "distances": [[] for _ in queries]}
+
+        # 分批计算 (行 x 查询) 的点积，每批只保留各自的 top-k 候选，最后再合并
+        candidate_scores, candidate_rows = [], []
+        for start in range(0, len(vectors), self.QUERY_BATCH_ROWS):
+            block = np.asarray(vectors[start:start + self.QUERY_BATCH_ROWS])
+            scores = block @ queries.T
+            scores[~alive[start:start + len(block)]] = -np.inf
+            block_k = min(k, len(block))
+            top = np.argpartition(-scores, block_k - 1, axis=0)[:block_k]
+            candidate_scores.append(np.take_along_axis(scores, top, axis=0))
+            candidate_rows.append(top + start)
+        scores = np.concatenate(candidate_scores)
+        rows = np.concatenate(candidate_rows)
+
+        result_ids, result_distances = [], []
+        for column in range(len(queries)):
+            column_scores = scores[:, column]
+            top = np.argpartition(-column_scores, k - 1)[:k]
+            top = top[np.argsort(-column_scores[top])]
+            top = top[np.isfinite(column_scores[top])]
+            result_ids.append([str(int(ids[row])) for row in rows[top, column]])
+            result_distances.append([float(1.0 - s) for s in column_scores[top]])
+        return {"ids": result_ids, "distances": result_distances}
+
+    # --- 墓碑与压缩 ---
+
+    def _append_tombstones(self, report_ids):
+        # 按ID而不是行号记录：行号只在本进程看到的文件状态下有意义
+        records = np.asarray([(report_id, len(self._ids)) for report_id in report_ids], dtype=np.int64)
+        with open(self._tombstones_path, "ab") as f:
+            f.write(records.tobytes())
+        self._alive[[self._row_of.pop(report_id) for report_id in report_ids]] = False
+        self._signature = self._file_signature()
+
+    def maybe_compact(self):
+        with self._locked(exclusive=True):
+            dead = len(self._ids) - len(self._row_of)
+            if dead >= self.compact_min_rows and dead >= self.compact_ratio * len(self._ids):
+                self.compact()
+
+    def compact(self):
+        """只保留存活的行重写文件，并清空墓碑。"""
+        with self._locked(exclusive=True):
+            keep = np.flatnonzero(self._alive)
+            print(f"正在压缩向量索引: {len(self._ids)} 行 -> {len(keep)} 行")
+            vectors_tmp = self._vectors_path.with_suffix(".f32.tmp")
+            ids_tmp = self._ids_path.with_suffix(".i64.tmp")
+            with open(vectors_tmp, "wb") as f:
+                for start in range(0, len(keep), self.QUERY_BATCH_ROWS):
+                    f.write(np.asarray(self._vectors[keep[start:start + self.QUERY_BATCH_ROWS]]).tobytes())
+            self._ids[keep].tofile(ids_tmp)
+
+            # 替换文件前先释放映射 (Windows 上无法替换仍被映射的文件)
+            self._vectors = None
+            os.replace(vectors_tmp, self._vectors_path)
+            os.replace(ids_tmp, self._ids_path)
+            self._tombstones_path.unlink(missing_ok=True)
+            self._load()
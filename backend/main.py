@@ -5,9 +5,12 @@ from sentence_transformers import SentenceTransformer
 import chromadb
 
 from backend.api.routes import router as api_router
+from backend.services.report_graph import init_graph_resources, create_checkpointed_graph, prune_old_runs
+from backend.services import run_leases
 from backend.database import models
 from backend.database.connection import engine
-from backend.config.config import BASE_DIR
+from backend.config.config import BASE_DIR, settings
+from backend.utils.rebuild_report_index import open_reports_collection, rebuild_report_index
 # --- 在应用启动时执行 ---
 models.Base.metadata.create_all(bind=engine)
 app = FastAPI(title="Multi-Model Report Generator API")
@@ -26,10 +29,34 @@ def startup_event():
     
     # 将两个集合都加载到 app.state 中
     # get_or_create_collection 会在集合不存在时创建它
-    app.state.reports_collection = chroma_client.get_or_create_collection(name="reports_collection")
+    # 报告相似度只做小规模的 top-k 查询，可以换用进程内的内存映射索引 (REPORT_INDEX_BACKEND=mmap)，接口与 Chroma 集合一致
+    app.state.reports_collection = open_reports_collection(chroma_client, app.state.sentence_model)
+    print(f"报告相似度检索使用 {settings.REPORT_INDEX_BACKEND} 后端。")
+    # 刚切换后端时索引是空的，用数据库中已保存的报告回填，否则历史报告无法被检索到
+    backfilled = rebuild_report_index(app.state.reports_collection, app.state.sentence_model, only_if_empty=True)
+    if backfilled:
+        print(f"报告相似度索引为空，已回填 {backfilled} 份历史报告。")
     app.state.knowledge_collection = chroma_client.get_or_create_collection(name="local_knowledge_base")
+    # 服务端对话会话的历史消息向量，用于按相似度召回窗口之外的旧对话
+    app.state.chat_history_collection = chroma_client.get_or_create_collection(name="chat_history")
     print("向量数据库初始化完毕。")
 
+    # 图节点通过注册的资源访问句向量模型和知识库，而不是通过(会被写入检查点的)图状态
+    init_graph_resources(app.state.sentence_model, app.state.knowledge_collection)
+
+
+@app.on_event("startup")
+async def init_report_graph():
+    print("正在编译带检查点的报告工作流...")
+    app.state.report_graph, app.state.checkpoint_conn = await create_checkpointed_graph()
+    await prune_old_runs(app.state.report_graph)
+    run_leases.prune_expired()
+
+
+@app.on_event("shutdown")
+async def close_report_graph():
+    await app.state.checkpoint_conn.close()
+
 # --- 中间件 ---
 app.add_middleware(
     CORSMiddleware,
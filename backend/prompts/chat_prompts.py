@@ -0,0 +1,31 @@
+# backend/prompts/chat_prompts.py
+
+# 服务端会话的系统提示词，{summary} 为滚动摘要。
+# 系统提示词只随摘要刷新而变化，使 "系统提示词 + 历史轮次" 这一前缀能被服务商的提示词缓存复用。
+CHAT_SESSION_SYSTEM_PROMPT = """你是一位乐于助人的AI助手，请结合对话上下文回答用户的问题。
+
+以下是本次对话较早部分的摘要:
+---
+{summary}
+---
+"""
+
+# 按相似度召回的旧对话片段每轮都不同，因此拼接在最新一条用户消息中，而不是放进系统提示词
+CHAT_RETRIEVED_CONTEXT_TEMPLATE = """以下是与当前问题相关的较早对话片段，供参考:
+---
+{retrieved}
+---
+
+{content}"""
+
+# 用于把超出窗口的旧对话合并进滚动摘要
+CHAT_SUMMARY_PROMPT = """请将“已有摘要”和“新增对话”合并为一份新的对话摘要。
+要求：保留用户的目标、偏好、已确认的事实和结论，以及尚未解决的问题；省略寒暄和重复内容；不超过400字。
+只返回摘要正文，不要有任何多余的前缀或解释。
+
+已有摘要:
+{summary}
+
+新增对话:
+{conversation}
+"""
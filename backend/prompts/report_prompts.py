@@ -15,12 +15,14 @@ TOPIC_EXPANDER_PROMPT_TEMPLATE = """
 
 
 
+# 注意各部分的顺序：服务商的提示词缓存按前缀命中，因此越稳定的内容越靠前——
+# 固定说明 -> 格式指令/模板 (同一模板的请求间相同) -> 知识库资料 -> 每次请求都不同的主题放在最后。
 FINAL_REPORT_PROMPT_TEMPLATE = """
 你是一位顶级的行业分析师，你的任务是基于以下几部分信息，生成一份最终的、结构化的专业报告。
 
-1.  **核心主题与新要求**:
+1.  **输出格式指令 (请严格遵循)**:
     ---
-    {topic}
+    {formatting_instructions}
     ---
 
 2.  **背景知识与参考资料 (来自我们的知识库，请优先参考和引用这些内容)**:
@@ -28,13 +30,19 @@ FINAL_REPORT_PROMPT_TEMPLATE = """
     {context}
     ---
 
-3.  **输出格式指令 (请严格遵循)**:
+3.  **核心主题与新要求**:
     ---
-    {formatting_instructions}
+    {topic}
     ---
 
 请严格按照以上所有要求，开始撰写你的结构化报告。
 """
 
 # 当用户没有提供模板时，我们将使用这段文字作为格式指令
-NO_TEMPLATE_INSTRUCTION = "未提供具体的格式模板，请你根据主题和背景资料，自行设计最合适的报告结构（必须包含标题、引言、多个逻辑分明的章节和小标题，以及总结性的结论）。"
\ No newline at end of file
+NO_TEMPLATE_INSTRUCTION = "未提供具体的格式模板，请你根据主题和背景资料，自行设计最合适的报告结构（必须包含标题、引言、多个逻辑分明的章节和小标题，以及总结性的结论）。"
+
+# 流式结构化输出时追加的格式约束：模型直接输出JSON文本，便于边生成边解析
+STREAMING_JSON_INSTRUCTION = """请只输出一个JSON对象作为你的完整回答，不要输出任何解释或Markdown代码块标记。
+字段请严格按照 title、introduction、sections、conclusion 的顺序依次输出。
+
+{format_instructions}"""
@@ -1,6 +1,6 @@
 # backend/schemas/report_schemas.py
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 import datetime
 
 # 定义报告中一个章节的结构
@@ -23,6 +23,21 @@ class ChatRequest(BaseModel):
     messages: List[Message]
     model: str    
 
+class ChatSessionCreateRequest(BaseModel):
+    model: str
+
+class ChatSessionMessageRequest(BaseModel):
+    content: str
+    model: Optional[str] = None  # 不传则沿用会话创建时的模型
+    # 会话之外发生、尚未写入会话的轮次 (如混合模式的主题和报告提示)，在新消息之前按顺序补写
+    history: List[Message] = []
+
+class ChatSessionInfo(BaseModel):
+    session_id: str
+    model: str
+    summary: str
+    messages: List[Message]
+
 class SaveRequest(BaseModel):
     topic: str
     model_name: str
@@ -40,4 +55,7 @@ class ReportMetadata(BaseModel):
 
 
 class TopicRequest(BaseModel):
-    topic: str
\ No newline at end of file
+    topic: str
+
+class FindSimilarRequest(TopicRequest):
+    prewarm: bool = False  # 调用方接下来会以混合模式生成报告时为 True，允许推测式预热
@@ -0,0 +1,237 @@
+# backend/services/chat_session.py
+import asyncio
+import datetime
+import re
+import uuid
+
+from sqlalchemy.orm import Session
+
+from backend.config.config import settings
+from backend.database import models
+from backend.database.connection import SessionLocal
+from backend.prompts import chat_prompts
+from backend.services.model_adapters import get_model_adapter
+
+_CJK_PATTERN = re.compile(r"[\u3400-\u9fff\uf900-\ufaff]")
+
+# 正在刷新摘要的会话ID，避免同一会话并发压缩
+_refreshing_sessions: set[str] = set()
+# 持有后台任务的引用，防止任务在完成前被垃圾回收
+_background_tasks: set[asyncio.Task] = set()
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数：中日韩字符按1个token计，其余按每4个字符1个token计。"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def create_session(db: Session, model_name: str) -> models.DbChatSession:
+    chat_session = models.DbChatSession(id=uuid.uuid4().hex, model_name=model_name, summary="", summarized_until=0)
+    db.add(chat_session)
+    db.commit()
+    db.refresh(chat_session)
+    return chat_session
+
+
+def get_session(db: Session, session_id: str) -> models.DbChatSession | None:
+    return db.query(models.DbChatSession).filter(models.DbChatSession.id == session_id).first()
+
+
+def get_session_messages(db: Session, session_id: str) -> list[models.DbChatMessage]:
+    return (
+        db.query(models.DbChatMessage)
+        .filter(models.DbChatMessage.session_id == session_id)
+        .order_by(models.DbChatMessage.id)
+        .all()
+    )
+
+
+def delete_session(db: Session, session_id: str, history_collection=None):
+    db.query(models.DbChatMessage).filter(models.DbChatMessage.session_id == session_id).delete(synchronize_session=False)
+    db.query(models.DbChatSession).filter(models.DbChatSession.id == session_id).delete(synchronize_session=False)
+    db.commit()
+    if history_collection is not None:
+        try:
+            history_collection.delete(where={"session_id": session_id})
+        except Exception as e:
+            print(f"从对话历史向量库删除会话 {session_id} 时出错: {e}")
+
+
+async def append_message(db: Session, session_id: str, role: str, content: str,
+                         sentence_model=None, history_collection=None) -> models.DbChatMessage:
+    """保存一条消息；开启历史召回时同时为其建立向量索引。"""
+    message = models.DbChatMessage(
+        session_id=session_id,
+        role=role,
+        content=content,
+        token_count=estimate_tokens(content),
+    )
+    db.add(message)
+    db.query(models.DbChatSession).filter(models.DbChatSession.id == session_id).update(
+        {"updated_at": datetime.datetime.utcnow()}
+    )
+    db.commit()
+    db.refresh(message)
+
+    if settings.CHAT_HISTORY_RETRIEVAL and sentence_model is not None and history_collection is not None and content:
+        try:
+            embedding = await asyncio.to_thread(sentence_model.encode, content)
+            history_collection.add(
+                embeddings=[embedding.tolist()],
+                documents=[f"{role}: {content}"],
+                metadatas=[{"session_id": session_id, "message_id": message.id}],
+                ids=[f"{session_id}_{message.id}"]
+            )
+        except Exception as e:
+            print(f"❌ 对话消息向量化失败: {e}")
+    return message
+
+
+def delete_message(db: Session, message: models.DbChatMessage, history_collection=None):
+    """删除一条消息 (例如没有得到回复的用户消息)，同时移除其历史向量。"""
+    db.query(models.DbChatMessage).filter(models.DbChatMessage.id == message.id).delete(synchronize_session=False)
+    db.commit()
+    if history_collection is not None:
+        try:
+            history_collection.delete(ids=[f"{message.session_id}_{message.id}"])
+        except Exception as e:
+            print(f"从对话历史向量库删除消息 {message.id} 时出错: {e}")
+
+
+def _recent_window(db: Session, session_id: str,
+                   summarized_until: int) -> tuple[list[models.DbChatMessage], int]:
+    """
+    从最新消息往前取，直到用完token预算，至少保留最新的一条。预算之外尚未摘要的消息继续留在窗口中，
+    最多再占用 CHAT_SUMMARY_TRIGGER_TOKENS，保证消息只有在能被摘要时才离开窗口。
+    返回 (按时间正序排列的窗口, 窗口开头属于预留部分的消息数)。
+    """
+    budget = settings.CHAT_WINDOW_TOKEN_BUDGET
+    newest_first = (
+        db.query(models.DbChatMessage)
+        .filter(models.DbChatMessage.session_id == session_id)
+        .order_by(models.DbChatMessage.id.desc())
+        .limit(settings.CHAT_WINDOW_MAX_MESSAGES)
+        .all()
+    )
+    window, used_tokens, reserved_count = [], 0, 0
+    for message in newest_first:
+        if window and (reserved_count or used_tokens + message.token_count > budget):
+            if (message.id <= summarized_until
+                    or used_tokens + message.token_count > budget + settings.CHAT_SUMMARY_TRIGGER_TOKENS):
+                break
+            reserved_count += 1
+        window.append(message)
+        used_tokens += message.token_count
+    window.reverse()
+    return window, reserved_count
+
+
+async def _retrieve_older_turns(session_id: str, query: str, before_id: int,
+                                sentence_model, history_collection) -> list[str]:
+    embedding = await asyncio.to_thread(sentence_model.encode, query)
+    results = history_collection.query(
+        query_embeddings=[embedding.tolist()],
+        n_results=settings.CHAT_RETRIEVAL_TOP_K,
+        where={"$and": [{"session_id": session_id}, {"message_id": {"$lt": before_id}}]}
+    )
+    return results.get('documents', [[]])[0]
+
+
+async def build_session_context(db: Session, chat_session: models.DbChatSession,
+                                sentence_model=None, history_collection=None) -> tuple[list[dict], bool]:
+    """
+    组装发给模型的消息列表：系统提示(滚动摘要) + token预算内的最近轮次，可选的召回片段并入最新一条消息。
+    返回 (messages, needs_compaction)，后者表示预算之外尚未摘要的历史已达到阈值，或已有消息放不进窗口。
+    """
+    window, reserved_count = _recent_window(db, chat_session.id, chat_session.summarized_until)
+    window_start_id = window[0].id if window else 0
+
+    overflow_tokens = sum(
+        token_count for (token_count,) in db.query(models.DbChatMessage.token_count).filter(
+            models.DbChatMessage.session_id == chat_session.id,
+            models.DbChatMessage.id > chat_session.summarized_until,
+            models.DbChatMessage.id < window_start_id,
+        )
+    )
+    reserved_tokens = sum(message.token_count for message in window[:reserved_count])
+    needs_compaction = overflow_tokens > 0 or reserved_tokens >= settings.CHAT_SUMMARY_TRIGGER_TOKENS
+
+    retrieved = []
+    if (settings.CHAT_HISTORY_RETRIEVAL and sentence_model is not None
+            and history_collection is not None and window):
+        try:
+            retrieved = await _retrieve_older_turns(
+                chat_session.id, window[-1].content, window_start_id, sentence_model, history_collection
+            )
+        except Exception as e:
+            print(f"❌ 召回较早对话失败: {e}")
+
+    messages = []
+    if chat_session.summary:
+        messages.append({
+            "role": "system",
+            "content": chat_prompts.CHAT_SESSION_SYSTEM_PROMPT.format(summary=chat_session.summary)
+        })
+    messages.extend({"role": message.role, "content": message.content} for message in window)
+    if retrieved:
+        # 召回片段放在最后一条消息里，保持前面的历史前缀稳定以命中提示词缓存
+        messages[-1]["content"] = chat_prompts.CHAT_RETRIEVED_CONTEXT_TEMPLATE.format(
+            retrieved="\n\n".join(retrieved),
+            content=messages[-1]["content"],
+        )
+    return messages, needs_compaction
+
+
+async def refresh_summary(session_id: str):
+    """把token预算之外 (包括窗口中的预留部分)、尚未摘要的历史合并进滚动摘要。在后台运行，使用独立的数据库会话。"""
+    if session_id in _refreshing_sessions:
+        return
+    _refreshing_sessions.add(session_id)
+    db = SessionLocal()
+    try:
+        chat_session = get_session(db, session_id)
+        if not chat_session:
+            return
+        window, reserved_count = _recent_window(db, session_id, chat_session.summarized_until)
+        # 预留部分也一并摘要，摘要完成后它们才离开窗口
+        budget_start_id = window[reserved_count].id if window else 0
+        overflow = (
+            db.query(models.DbChatMessage)
+            .filter(
+                models.DbChatMessage.session_id == session_id,
+                models.DbChatMessage.id > chat_session.summarized_until,
+                models.DbChatMessage.id < budget_start_id,
+            )
+            .order_by(models.DbChatMessage.id)
+            .all()
+        )
+        if not overflow:
+            return
+
+        print(f"正在为会话 {session_id} 压缩 {len(overflow)} 条历史消息...")
+        conversation = "\n".join(f"{message.role}: {message.content}" for message in overflow)
+        prompt = chat_prompts.CHAT_SUMMARY_PROMPT.format(
+            summary=chat_session.summary or "无",
+            conversation=conversation,
+        )
+        adapter = get_model_adapter(chat_session.model_name)
+        llm = adapter.create_chat_model(model_name=chat_session.model_name, temperature=0.2)
+        response = await llm.ainvoke(prompt)
+
+        chat_session.summary = response.content.strip()
+        chat_session.summarized_until = overflow[-1].id
+        db.commit()
+        print(f"会话 {session_id} 的滚动摘要已更新至消息ID {chat_session.summarized_until}。")
+    except Exception as e:
+        print(f"❌ 刷新会话摘要失败: {e}")
+    finally:
+        db.close()
+        _refreshing_sessions.discard(session_id)
+
+
+def schedule_summary_refresh(session_id: str):
+    """在后台异步刷新摘要，不阻塞当前请求。"""
+    task = asyncio.create_task(refresh_summary(session_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
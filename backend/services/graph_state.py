@@ -1,4 +1,4 @@
-from typing import List, TypedDict, Optional, Any
+from typing import List, TypedDict, Optional
 from backend.schemas.report_schemas import StructuredReport
 
 class GraphState(TypedDict):
@@ -8,6 +8,6 @@ class GraphState(TypedDict):
     final_report: Optional[StructuredReport] # 节点3的输出：最终报告
     model_name: str              # 要使用的模型名称
     template_content: Optional[str]   #可选的模板内容
-    sentence_model: Optional[Any]
-    reports_collection: Optional[Any]
-    knowledge_collection: Optional[Any]
\ No newline at end of file
+    stream_report: Optional[bool]     # 是否以流式方式生成最终报告 (通过 custom 流推送增量事件)
+    # 注意：句向量模型、向量库集合等不可序列化的资源不放在状态中 (状态会写入检查点)，
+    # 由 report_graph.init_graph_resources 在应用启动时注册。
\ No newline at end of file
@@ -0,0 +1,17 @@
+# backend/services/metrics.py
+from collections import defaultdict
+import threading
+
+# 进程内的简单计数器，通过 /api/metrics 暴露
+_counters: dict[str, float] = defaultdict(float)
+_lock = threading.Lock()
+
+
+def increment(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot() -> dict[str, float]:
+    with _lock:
+        return dict(_counters)
@@ -2,6 +2,7 @@
 from langchain_openai import ChatOpenAI
 from langchain_google_genai import ChatGoogleGenerativeAI
 from backend.config.config import settings, MODEL_MAPPING 
+from backend.services.prompt_cache import PromptCacheUsageHandler
 
 # 这是一个抽象基类或接口的概念，实际可省略
 class ModelAdapter:
@@ -15,6 +16,7 @@ class GeminiAdapter(ModelAdapter):
             model=model_name,
             google_api_key=settings.GOOGLE_API_KEY,
             temperature=temperature,
+            callbacks=[PromptCacheUsageHandler(model_name)],
         )
 
 class OpenAIAdapter(ModelAdapter):
@@ -22,7 +24,9 @@ class OpenAIAdapter(ModelAdapter):
         return ChatOpenAI(
             model=model_name,
             api_key=settings.OPENAI_API_KEY,
-            temperature=temperature
+            temperature=temperature,
+            stream_usage=True, # 流式调用时同样返回用量 (含缓存命中的token数)
+            callbacks=[PromptCacheUsageHandler(model_name)],
         )
         
 class DeepSeekAdapter(ModelAdapter):
@@ -31,7 +35,9 @@ class DeepSeekAdapter(ModelAdapter):
             model=model_name,
             api_key=settings.DEEPSEEK_API_KEY,
             base_url="https://api.deepseek.com/v1",
-            temperature=temperature
+            temperature=temperature,
+            stream_usage=True,
+            callbacks=[PromptCacheUsageHandler(model_name)],
         )
 
 # 工厂函数：根据模型名称返回对应的适配器实例
@@ -0,0 +1,54 @@
+# backend/services/prompt_cache.py
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from backend.services import metrics
+
+
+def _prompt_token_usage(response: LLMResult) -> tuple[int, int] | None:
+    """从一次调用的结果中取出 (输入token数, 命中缓存的token数)，服务商未返回用量时为 None。"""
+    generation = response.generations[0][0] if response.generations and response.generations[0] else None
+    message = getattr(generation, "message", None)
+
+    # LangChain 统一后的用量字段 (OpenAI/vLLM 的 cached_tokens、Gemini 的 cached_content_token_count)
+    usage = getattr(message, "usage_metadata", None)
+    if usage and usage.get("input_tokens"):
+        cached = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        if not cached:
+            # DeepSeek 通过 OpenAI 兼容接口返回 prompt_cache_hit_tokens
+            token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+            cached = token_usage.get("prompt_cache_hit_tokens") or 0
+        return usage["input_tokens"], cached
+
+    token_usage = (response.llm_output or {}).get("token_usage") or {}
+    if token_usage.get("prompt_tokens"):
+        cached = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") \
+            or token_usage.get("prompt_cache_hit_tokens") or 0
+        return token_usage["prompt_tokens"], cached
+    return None
+
+
+class PromptCacheUsageHandler(AsyncCallbackHandler):
+    """记录每次模型调用中命中服务商提示词缓存的输入token比例，并累计到 /api/metrics。"""
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+
+    async def on_llm_end(self, response: LLMResult, **kwargs):
+        usage = _prompt_token_usage(response)
+        if usage is None:
+            return
+        input_tokens, cached_tokens = usage
+        metrics.increment(f"prompt_tokens:{self.model_name}", input_tokens)
+        metrics.increment(f"cached_prompt_tokens:{self.model_name}", cached_tokens)
+        print(f"[提示词缓存] 模型 {self.model_name}: 输入 {input_tokens} tokens，"
+              f"命中缓存 {cached_tokens} ({cached_tokens / input_tokens:.0%})")
+
+
+def cached_token_ratios(snapshot: dict) -> dict[str, float]:
+    """按模型计算累计的缓存命中比例。"""
+    ratios = {}
+    for key, prompt_tokens in snapshot.items():
+        if key.startswith("prompt_tokens:") and prompt_tokens:
+            model_name = key.split(":", 1)[1]
+            ratios[model_name] = snapshot.get(f"cached_prompt_tokens:{model_name}", 0) / prompt_tokens
+    return ratios
@@ -1,11 +1,25 @@
 # backend/services/report_generator.py
+from typing import AsyncIterator
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import JsonOutputParser
+from pydantic import ValidationError
 from backend.prompts import report_prompts
 from backend.services.model_adapters import get_model_adapter
-from backend.schemas.report_schemas import StructuredReport
+from backend.schemas.report_schemas import StructuredReport, ReportSection
 import json
 import asyncio 
 
+# 流式结构化输出使用的JSON解析器，支持对不完整的JSON文本做增量解析
+report_json_parser = JsonOutputParser(pydantic_object=StructuredReport)
+
+
+def build_system_prompt(streaming: bool = False) -> str:
+    """返回报告生成的系统提示词；流式模式下追加JSON格式约束 (需要填充 format_instructions 变量)。"""
+    if streaming:
+        return report_prompts.SYSTEM_INSTRUCTION + "\n\n" + report_prompts.STREAMING_JSON_INSTRUCTION
+    return report_prompts.SYSTEM_INSTRUCTION
+
+
 async def generate_structured_report(topic: str, model_name: str, template_content: str = "") -> StructuredReport:
     """
     根据主题、模型名称以及可选的模板内容，异步生成结构化的报告。
@@ -38,6 +52,62 @@ async def generate_structured_report(topic: str, model_name: str, template_conte
     print(f"--> [成功] 模型 {model_name} 已生成报告。")
     return result
 
+
+class _ReportEventTracker:
+    """
+    跟踪增量解析出的报告字典，判断哪些字段已经"写完"。
+    模型按 title -> introduction -> sections -> conclusion 的顺序输出，
+    因此某个字段之后出现了新的键 (或新的章节)，即可认为该字段已完整。
+    """
+    def __init__(self):
+        self._emitted_fields = set()
+        self._emitted_sections = 0
+
+    def update(self, partial, final: bool = False) -> list[dict]:
+        if not isinstance(partial, dict) or not partial:
+            return []
+        last_key = list(partial.keys())[-1]
+        events = []
+
+        for field in ("title", "introduction"):
+            if field in self._emitted_fields or not isinstance(partial.get(field), str):
+                continue
+            if final or last_key != field:
+                events.append({"event": field, "data": partial[field]})
+                self._emitted_fields.add(field)
+
+        sections = partial.get("sections")
+        if isinstance(sections, list):
+            # 最后一个章节可能仍在输出中，只有在 sections 之后出现新键或流结束时才算完整
+            ready = len(sections) if (final or last_key != "sections") else len(sections) - 1
+            while self._emitted_sections < ready:
+                try:
+                    section = ReportSection.model_validate(sections[self._emitted_sections])
+                except ValidationError:
+                    break
+                events.append({"event": "section", "index": self._emitted_sections, "data": section})
+                self._emitted_sections += 1
+        return events
+
+
+async def stream_report_events(llm, formatted_prompt) -> AsyncIterator[dict]:
+    """
+    以流式方式调用模型并增量解析JSON输出。
+    依次产出 title / introduction / section 事件，最后产出 report 事件，其 data 为校验后的 StructuredReport。
+    """
+    tracker = _ReportEventTracker()
+    partial = None
+    async for partial in (llm | report_json_parser).astream(formatted_prompt):
+        for event in tracker.update(partial):
+            yield event
+
+    if partial is None:
+        raise ValueError("模型没有返回任何内容。")
+    for event in tracker.update(partial, final=True):
+        yield event
+    yield {"event": "report", "data": StructuredReport.model_validate(partial)}
+
+
 # (辅助函数) 将结构化报告转换为Markdown
 def convert_report_to_markdown(report: StructuredReport) -> str:
     md = f"# {report.title}\n\n"
@@ -48,9 +118,18 @@ def convert_report_to_markdown(report: StructuredReport) -> str:
     return md
 
 
-async def generate_chat_stream(messages: list, model_name: str):
+def serialize_report_event(event: dict) -> dict:
+    """将报告事件中的 Pydantic 对象转换为可JSON序列化的字典。"""
+    data = event.get("data")
+    if isinstance(data, (StructuredReport, ReportSection)):
+        return {**event, "data": data.model_dump()}
+    return event
+
+
+async def generate_chat_stream(messages: list, model_name: str, raise_errors: bool = False):
     """
     根据对话历史和模型名称，以流式方式生成响应。
+    默认把错误转换为一段提示文本输出；raise_errors 为 True 时直接抛出，由调用方区分失败和正常回复。
     """
     print(f"开始为对话生成流式响应，模型: {model_name}")
     try:
@@ -63,4 +142,6 @@ async def generate_chat_stream(messages: list, model_name: str):
             
     except Exception as e:
         print(f"❌ 流式对话生成失败: {e}")
+        if raise_errors:
+            raise
         yield f"抱歉，处理您的请求时出现错误: {e}"
\ No newline at end of file
@@ -2,16 +2,36 @@
 
 from langchain_core.prompts import ChatPromptTemplate
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+import aiosqlite
 import chromadb
 import asyncio
+import datetime
+import json
 from sentence_transformers import SentenceTransformer
 
 from backend.services.graph_state import GraphState
 from backend.services.model_adapters import get_model_adapter
+from backend.services.report_generator import build_system_prompt, report_json_parser, stream_report_events
 from backend.schemas.report_schemas import StructuredReport
 from backend.prompts import report_prompts
 from backend.config.config import BASE_DIR, settings
+from backend.database import models
+from backend.database.connection import SessionLocal
 
+# 检查点数据库：每个模型的每次运行以 "{run_id}:{model_name}" 作为 thread_id 保存节点进度
+CHECKPOINT_DB_PATH = BASE_DIR / "checkpoints.db"
+
+# 图节点共享的运行时资源 (句向量模型、知识库集合)。
+# 它们不可序列化，因此不放进 GraphState，避免被写入检查点。
+_graph_resources: dict = {}
+
+
+def init_graph_resources(sentence_model, knowledge_collection):
+    """在应用启动时注册图节点所需的共享资源。"""
+    _graph_resources["sentence_model"] = sentence_model
+    _graph_resources["knowledge_collection"] = knowledge_collection
 
 
 # --- 定义图的节点 ---
@@ -37,8 +57,8 @@ async def retrieve_context_node(state: GraphState) -> GraphState:
     """节点2: 从本地知识库进行RAG检索"""
     print(f"---[节点2: 上下文检索] | 收到状态键: {list(state.keys())} ---")
 
-    knowledge_collection = state.get('knowledge_collection')
-    sentence_model = state.get('sentence_model')
+    knowledge_collection = _graph_resources.get('knowledge_collection')
+    sentence_model = _graph_resources.get('sentence_model')
 
     if not knowledge_collection or not sentence_model:
         print("知识库未初始化，跳过检索。")
@@ -70,6 +90,7 @@ async def generate_report_node(state: GraphState) -> GraphState:
     context = state['retrieved_context']
     model_name = state['model_name']
     template_content = state.get('template_content') # 安全地获取模板内容
+    streaming = bool(state.get('stream_report'))
 
     if template_content:
         print("    检测到用户模板，将用其作为格式指令。")
@@ -80,11 +101,10 @@ async def generate_report_node(state: GraphState) -> GraphState:
 
     adapter = get_model_adapter(model_name)
     llm = adapter.create_chat_model(model_name=model_name, temperature=0.5)
-    structured_llm = llm.with_structured_output(StructuredReport)
 
     # 使用我们新的“终极”模板
     prompt_template = ChatPromptTemplate.from_messages([
-        ("system", report_prompts.SYSTEM_INSTRUCTION),
+        ("system", build_system_prompt(streaming)),
         ("human", report_prompts.FINAL_REPORT_PROMPT_TEMPLATE),
     ])
 
@@ -94,10 +114,23 @@ async def generate_report_node(state: GraphState) -> GraphState:
         "context": context,
         "formatting_instructions": formatting_instructions
     }
+    if streaming:
+        prompt_inputs["format_instructions"] = report_json_parser.get_format_instructions()
 
     formatted_prompt = prompt_template.invoke(prompt_inputs)
 
-    response = await structured_llm.ainvoke(formatted_prompt)
+    if streaming:
+        # 增量解析模型输出，每完成一个部分就通过 custom 流推送给调用方
+        writer = get_stream_writer()
+        response = None
+        async for event in stream_report_events(llm, formatted_prompt):
+            if event["event"] == "report":
+                response = event["data"]
+            else:
+                writer(event)
+    else:
+        structured_llm = llm.with_structured_output(StructuredReport)
+        response = await structured_llm.ainvoke(formatted_prompt)
     print("最终报告已生成。")
     return {"final_report": response}
 
@@ -110,12 +143,71 @@ workflow.add_node("expand_topic", expand_topic_node)
 workflow.add_node("retrieve_context", retrieve_context_node)
 workflow.add_node("generate_report", generate_report_node)
 
+def route_entry(state: GraphState) -> str:
+    """推测式预热命中时，初始状态中已带有扩展查询和检索结果，直接进入报告生成。"""
+    if state.get("expanded_queries") and state.get("retrieved_context"):
+        print("---[入口] 复用预热的主题扩展和检索结果 ---")
+        return "generate_report"
+    return "expand_topic"
+
+
 # 定义边的连接关系
-workflow.set_entry_point("expand_topic")
+workflow.set_conditional_entry_point(route_entry, {
+    "expand_topic": "expand_topic",
+    "generate_report": "generate_report",
+})
 workflow.add_edge("expand_topic", "retrieve_context")
 workflow.add_edge("retrieve_context", "generate_report")
 workflow.add_edge("generate_report", END)
 
-# 编译图
-graph = workflow.compile()
-print("LangGraph 工作流已编译完成。")
\ No newline at end of file
+async def create_checkpointed_graph(db_path: str = str(CHECKPOINT_DB_PATH)):
+    """
+    编译一个由本地SQLite检查点支持的图，每个节点完成后都会保存进度，
+    失败的运行可以通过 graph.ainvoke(None, config) 从最后完成的节点继续。
+    返回 (graph, connection)，连接需在应用关闭时关闭。
+    """
+    conn = await aiosqlite.connect(db_path)
+    checkpointer = AsyncSqliteSaver(conn)
+    await checkpointer.setup()
+    print(f"LangGraph 检查点数据库: {db_path}")
+    return workflow.compile(checkpointer=checkpointer), conn
+
+
+def make_thread_id(run_id: str, model_name: str) -> str:
+    """某次运行中某个模型对应的检查点线程ID。"""
+    return f"{run_id}:{model_name}"
+
+
+def thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+async def prune_old_runs(report_graph, retention_days: int = settings.REPORT_RUN_RETENTION_DAYS):
+    """
+    删除超过保留期的混合模式运行记录及其检查点线程。每次运行都会为每个模型保存检索上下文和完整报告，
+    不清理的话检查点数据库会一直增长。仍被较新运行引用的线程 (合并到旧运行上的模型) 会被保留。
+    """
+    if retention_days <= 0:
+        return
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=retention_days)
+    db = SessionLocal()
+    try:
+        expired = db.query(models.DbReportRun).filter(models.DbReportRun.created_at < cutoff).all()
+        if not expired:
+            return
+        kept_threads = {
+            thread_id
+            for (model_threads,) in db.query(models.DbReportRun.model_threads).filter(models.DbReportRun.created_at >= cutoff)
+            for thread_id in json.loads(model_threads).values()
+        }
+        stale_threads = {
+            thread_id for run in expired for thread_id in json.loads(run.model_threads).values()
+        } - kept_threads
+        for thread_id in stale_threads:
+            await report_graph.checkpointer.adelete_thread(thread_id)
+        # 批量删除：多个工作进程同时启动时可能都在清理，已被删掉的行直接跳过
+        db.query(models.DbReportRun).filter(models.DbReportRun.created_at < cutoff).delete(synchronize_session=False)
+        db.commit()
+        print(f"已清理 {len(expired)} 条超过 {retention_days} 天的运行记录及 {len(stale_threads)} 个检查点线程。")
+    finally:
+        db.close()
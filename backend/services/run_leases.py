@@ -0,0 +1,88 @@
+# backend/services/run_leases.py
+import asyncio
+import datetime
+import uuid
+from contextlib import asynccontextmanager
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from backend.config.config import settings
+from backend.database import models
+from backend.database.connection import SessionLocal
+
+
+def _try_acquire(thread_id: str, holder: str) -> bool:
+    """插入租约行；已存在时只有在租约过期 (持有者可能已崩溃) 或本来就由自己持有时才接管。"""
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=settings.RUN_LEASE_TTL)
+    db = SessionLocal()
+    try:
+        db.add(models.DbThreadLease(thread_id=thread_id, holder=holder, expires_at=expires_at))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+        updated = db.query(models.DbThreadLease).filter(
+            models.DbThreadLease.thread_id == thread_id,
+            or_(models.DbThreadLease.expires_at <= now, models.DbThreadLease.holder == holder),
+        ).update({"holder": holder, "expires_at": expires_at}, synchronize_session=False)
+        db.commit()
+        return updated == 1
+    finally:
+        db.close()
+
+
+def _release(thread_id: str, holder: str):
+    db = SessionLocal()
+    try:
+        db.query(models.DbThreadLease).filter(
+            models.DbThreadLease.thread_id == thread_id,
+            models.DbThreadLease.holder == holder,
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+async def _keep_renewed(thread_id: str, holder: str):
+    while True:
+        await asyncio.sleep(settings.RUN_LEASE_TTL / 3)
+        if not _try_acquire(thread_id, holder):
+            print(f"❌ 检查点线程 {thread_id} 的租约已被其他进程接管。")
+            return
+
+
+@asynccontextmanager
+async def hold(thread_id: str):
+    """
+    持有某个检查点线程的运行租约 (跨工作进程)。租约被其他进程持有时先等待它释放或过期，
+    因此同一线程在所有进程中同一时刻只会有一次执行。
+    """
+    holder = uuid.uuid4().hex
+    waited = False
+    while not _try_acquire(thread_id, holder):
+        if not waited:
+            print(f"检查点线程 {thread_id} 正在其他工作进程中执行，等待其结束...")
+            waited = True
+        await asyncio.sleep(settings.RUN_LEASE_POLL_INTERVAL)
+    renew_task = asyncio.create_task(_keep_renewed(thread_id, holder))
+    try:
+        yield
+    finally:
+        renew_task.cancel()
+        _release(thread_id, holder)
+
+
+
+def prune_expired():
+    """删除已过期的租约 (持有进程崩溃后遗留的行)。"""
+    db = SessionLocal()
+    try:
+        db.query(models.DbThreadLease).filter(
+            models.DbThreadLease.expires_at <= datetime.datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
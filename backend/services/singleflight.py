@@ -0,0 +1,130 @@
+# backend/services/singleflight.py
+import asyncio
+from typing import Awaitable, Callable
+
+from backend.services import metrics
+
+
+class InFlightRun:
+    """
+    一次正在执行的工作流。领头的请求负责启动它，之后相同的请求都挂到同一个实例上：
+    流式订阅者会先重放已产生的事件再继续跟随，阻塞调用者只等待最终结果。
+    """
+    def __init__(self, key: str, thread_id: str):
+        self.key = key
+        self.thread_id = thread_id
+        self.subscribers = 0             # 仍在等待结果的请求数，降为0时运行会被取消
+        self.task: asyncio.Task | None = None
+        self.events: list[dict] = []
+        self.done = False
+        self.result = None
+        self.error: BaseException | None = None
+        self._condition = asyncio.Condition()
+
+    async def publish(self, event: dict):
+        async with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    async def _finish(self, result=None, error: BaseException | None = None):
+        async with self._condition:
+            self.result, self.error, self.done = result, error, True
+            self._condition.notify_all()
+
+    async def subscribe(self):
+        """依次产出该运行的所有增量事件 (包括订阅之前已经产生的)，运行结束时返回。"""
+        index = 0
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: index < len(self.events) or self.done)
+                pending, index = self.events[index:], len(self.events)
+                finished = self.done
+            for event in pending:
+                yield event
+            if finished and index == len(self.events):
+                return
+
+    async def wait(self):
+        """等待运行结束，返回最终结果或抛出运行中的异常。"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.done)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """按键合并相同的进行中请求：同一时刻每个键最多只有一个真实执行。"""
+    def __init__(self):
+        self._runs: dict[str, InFlightRun] = {}
+        # 按检查点线程索引进行中的运行，供重试等按线程恢复的请求挂到仍在执行的运行上
+        self._by_thread: dict[str, InFlightRun] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def get_or_start(self, key: str, thread_id: str,
+                     runner: Callable[[InFlightRun], Awaitable]) -> tuple[InFlightRun, bool]:
+        """
+        返回 (run, started)。已有相同键的运行时直接复用，started 为 False。
+        调用方会被计为该运行的一个订阅者，不再需要结果时 (包括客户端断开) 必须调用 release。
+        """
+        run = self._runs.get(key)
+        if run is not None:
+            self._join(run, "coalesced_requests")
+            return run, False
+
+        run = InFlightRun(key, thread_id)
+        run.subscribers = 1
+        self._runs[key] = run
+        self._by_thread[thread_id] = run
+        # 运行与发起它的请求解耦，领头请求断开时其他订阅者仍能拿到结果
+        run.task = asyncio.create_task(self._drive(key, run, runner))
+        self._tasks.add(run.task)
+        run.task.add_done_callback(self._tasks.discard)
+        return run, True
+
+    def attach(self, thread_id: str) -> InFlightRun | None:
+        """若该检查点线程上有进行中的运行，把调用方计为它的订阅者并返回；否则返回 None。"""
+        run = self._by_thread.get(thread_id)
+        if run is not None:
+            # 单独计数，不混入 coalesced_requests (后者只统计被合并的重复生成请求)
+            self._join(run, "attached_retries")
+        return run
+
+    def _join(self, run: InFlightRun, metric: str):
+        run.subscribers += 1
+        metrics.increment(metric)
+        print(f"合并到进行中的运行: {run.key}")
+
+    def _forget(self, run: InFlightRun):
+        if self._runs.get(run.key) is run:
+            del self._runs[run.key]
+        if self._by_thread.get(run.thread_id) is run:
+            del self._by_thread[run.thread_id]
+
+    def release(self, run: InFlightRun):
+        """订阅者离开。最后一个订阅者离开而运行尚未结束时，取消运行以停止仍在进行的模型调用。"""
+        run.subscribers -= 1
+        if run.subscribers > 0 or run.done:
+            return
+        # 先从注册表移除，避免新请求挂到一个正在取消的运行上
+        self._forget(run)
+        if run.task is not None and not run.task.done():
+            run.task.cancel()
+            metrics.increment("cancelled_runs")
+            print(f"已无订阅者，取消运行: {run.key}")
+
+    async def _drive(self, key: str, run: InFlightRun, runner):
+        try:
+            result = await runner(run)
+        except BaseException as e:
+            await run._finish(error=e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            await run._finish(result=result)
+        finally:
+            self._forget(run)
+
+
+# 报告工作流共用的合并器
+report_runs = SingleFlight()
@@ -0,0 +1,126 @@
+# backend/services/speculation.py
+import asyncio
+import datetime
+import json
+
+from backend.config.config import settings
+from backend.database import models
+from backend.database.connection import SessionLocal
+from backend.services import metrics
+from backend.services.report_graph import expand_topic_node, retrieve_context_node
+
+# 预热结果保存在共享的SQLite数据库 (speculations 表) 中：多工作进程部署时，
+# find-similar 和随后的生成请求通常落在不同进程，进程内缓存几乎无法命中。
+
+# 本进程中正在进行的预热任务 (其他进程的预热完成之前看不到其结果)
+_inflight: dict[str, asyncio.Task] = {}
+
+
+def _speculation_key(topic: str, model_name: str) -> str:
+    normalized_topic = " ".join(topic.split()).casefold()
+    return f"{model_name}|{normalized_topic}"
+
+
+def _purge_expired(db):
+    db.query(models.DbSpeculation).filter(
+        models.DbSpeculation.expires_at <= datetime.datetime.utcnow()
+    ).delete(synchronize_session=False)
+    db.commit()
+
+
+def _store(key: str, payload: dict):
+    db = SessionLocal()
+    try:
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=settings.SPECULATIVE_CACHE_TTL)
+        db.merge(models.DbSpeculation(key=key, payload=json.dumps(payload, ensure_ascii=False), expires_at=expires_at))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _is_cached(db, key: str) -> bool:
+    return db.query(models.DbSpeculation.key).filter(
+        models.DbSpeculation.key == key,
+        models.DbSpeculation.expires_at > datetime.datetime.utcnow(),
+    ).first() is not None
+
+
+def _take(key: str) -> dict | None:
+    """取出并删除一条未过期的结果；多个进程同时取同一条时只有删除成功的一方得到它。"""
+    db = SessionLocal()
+    try:
+        _purge_expired(db)
+        entry = db.query(models.DbSpeculation).filter(models.DbSpeculation.key == key).first()
+        if entry is None:
+            return None
+        payload = entry.payload
+        deleted = db.query(models.DbSpeculation).filter(
+            models.DbSpeculation.key == key
+        ).delete(synchronize_session=False)
+        db.commit()
+        return json.loads(payload) if deleted else None
+    finally:
+        db.close()
+
+
+async def _prewarm(key: str, topic: str, model_name: str):
+    try:
+        state = {"original_topic": topic, "model_name": model_name}
+        state.update(await expand_topic_node(state))
+        retrieved = await retrieve_context_node(state)
+        _store(key, {"expanded_queries": state["expanded_queries"], **retrieved})
+        metrics.increment("speculation_completed")
+        print(f"预热完成: {key}")
+    except Exception as e:
+        print(f"❌ 预热失败 {key}: {e}")
+    finally:
+        _inflight.pop(key, None)
+
+
+async def start_prewarm(topic: str):
+    """
+    为每个混合模式模型在后台预先执行主题扩展和知识检索。
+    并发预热数达到上限时直接跳过，不排队，避免挤占真实请求。
+    """
+    if not settings.SPECULATIVE_PREWARM or not topic:
+        return
+    keys = {model_name: _speculation_key(topic, model_name) for model_name in settings.MIXED_MODE_MODELS}
+    db = SessionLocal()
+    try:
+        _purge_expired(db)
+        cached = {key for key in keys.values() if _is_cached(db, key)}
+    finally:
+        db.close()
+    for model_name, key in keys.items():
+        if key in cached or key in _inflight:
+            continue
+        if len(_inflight) >= settings.SPECULATIVE_MAX_CONCURRENCY:
+            metrics.increment("speculation_skipped")
+            continue
+        metrics.increment("speculation_started")
+        _inflight[key] = asyncio.create_task(_prewarm(key, topic, model_name))
+
+
+async def take_prewarmed(topic: str, model_name: str) -> dict | None:
+    """
+    取出该主题/模型的预热结果 (只使用一次)；预热仍在本进程中进行时等待其完成。
+    未命中时返回 None，过期的结果会被丢弃。
+    """
+    if not settings.SPECULATIVE_PREWARM:
+        return None
+    key = _speculation_key(topic, model_name)
+    task = _inflight.get(key)
+    if task is not None:
+        # shield: 当前请求被取消时不连带取消预热任务
+        await asyncio.shield(task)
+    entry = _take(key)
+    if entry is None:
+        metrics.increment("speculation_misses")
+        return None
+    metrics.increment("speculation_hits")
+    return entry
+
+
+def hit_rate(snapshot: dict) -> float | None:
+    lookups = snapshot.get("speculation_hits", 0) + snapshot.get("speculation_misses", 0)
+    return snapshot.get("speculation_hits", 0) / lookups if lookups else None
@@ -0,0 +1,90 @@
+# backend/utils/benchmark_vector_index.py
+# 对比报告相似度检索的两种后端：Chroma 集合 与 内存映射向量索引 (MmapVectorIndex)。
+# 用法: python -m backend.utils.benchmark_vector_index --sizes 10000 100000 1000000
+
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BACKEND_DIR.parent))
+
+from backend.database.vector_index import MmapVectorIndex
+
+DIM = 384  # all-MiniLM-L6-v2 的向量维度
+TOP_K = 3
+
+
+def random_unit_vectors(rng, n: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, DIM), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def measure_queries(collection, queries: np.ndarray) -> dict:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query.tolist()], n_results=TOP_K)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies = np.asarray(latencies)
+    return {"p50": np.percentile(latencies, 50), "p95": np.percentile(latencies, 95)}
+
+
+def build_mmap(directory: Path, vectors: np.ndarray, batch_size: int):
+    index = MmapVectorIndex(directory, dim=DIM)
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset:offset + batch_size]
+        index.add(embeddings=batch, ids=range(offset, offset + len(batch)))
+    return index, time.perf_counter() - start
+
+
+def build_chroma(directory: Path, vectors: np.ndarray, batch_size: int):
+    import chromadb
+
+    client = chromadb.PersistentClient(path=str(directory))
+    collection = client.get_or_create_collection(name="benchmark")
+    batch_size = min(batch_size, client.get_max_batch_size())
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), batch_size):
+        batch = vectors[offset:offset + batch_size]
+        collection.add(embeddings=batch.tolist(), ids=[str(i) for i in range(offset, offset + len(batch))])
+    return collection, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="报告相似度检索后端基准测试")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--chroma-max", type=int, default=1_000_000, help="超过该规模时跳过 Chroma (写入很慢)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    queries = random_unit_vectors(rng, args.queries)
+    print(f"{'后端':<8}{'向量数':>10}{'写入(s)':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+
+    for size in args.sizes:
+        vectors = random_unit_vectors(rng, size)
+        backends = [("mmap", build_mmap)]
+        if size <= args.chroma_max:
+            backends.append(("chroma", build_chroma))
+        for name, build in backends:
+            workdir = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+            collection = None
+            try:
+                collection, build_seconds = build(workdir, vectors, args.batch_size)
+                stats = measure_queries(collection, queries)
+                print(f"{name:<8}{size:>10}{build_seconds:>10.1f}{stats['p50']:>10.2f}{stats['p95']:>10.2f}")
+            finally:
+                del collection
+                shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# backend/utils/dedup.py
+# 基于 MinHash + LSH 的近重复文本块检测，用于知识库注入前去重。
+
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _shingles(text: str, size: int) -> set[int]:
+    """按字符 n-gram 切分 (同时适用于中文和英文)，并哈希为32位整数。"""
+    normalized = _WHITESPACE.sub(" ", text).strip().lower()
+    if len(normalized) <= size:
+        return {zlib.crc32(normalized.encode("utf-8"))}
+    return {zlib.crc32(normalized[i:i + size].encode("utf-8")) for i in range(len(normalized) - size + 1)}
+
+
+def _optimal_bands(threshold: float, num_perm: int) -> tuple[int, int]:
+    """选择 (bands, rows)，使 LSH 的S曲线拐点 (1/b)^(1/r) 最接近目标阈值。"""
+    best, best_error = (1, num_perm), float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if error < best_error:
+            best, best_error = (bands, rows), error
+    return best
+
+
+@dataclass
+class DedupStats:
+    total: int = 0
+    kept: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+    chars_before: int = 0
+    chars_after: int = 0
+
+    @property
+    def removed(self) -> int:
+        return self.total - self.kept
+
+    def summary(self) -> str:
+        ratio = self.removed / self.total if self.total else 0.0
+        return (f"去重前 {self.total} 个小块 ({self.chars_before} 字) -> 去重后 {self.kept} 个小块 "
+                f"({self.chars_after} 字)，移除 {self.removed} 个 ({ratio:.1%})：完全重复 {self.exact_duplicates} 个，"
+                f"近似重复 {self.near_duplicates} 个。")
+
+
+@dataclass
+class NearDuplicateFilter:
+    """
+    流式近重复过滤器：依次加入文本，与已保留的文本做 MinHash 相似度比较，
+    估计的 Jaccard 相似度不低于 threshold 时判定为重复。
+    """
+    threshold: float = 0.8
+    num_perm: int = 128
+    shingle_size: int = 5
+    seed: int = 1
+    stats: DedupStats = field(default_factory=DedupStats)
+
+    def __post_init__(self):
+        rng = np.random.RandomState(self.seed)
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=self.num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=self.num_perm, dtype=np.uint64)
+        self.bands, self.rows = _optimal_bands(self.threshold, self.num_perm)
+        self._buckets: list[dict[bytes, list[int]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures: list[np.ndarray] = []
+        self._exact: dict[bytes, int] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(_shingles(text, self.shingle_size), dtype=np.uint64)
+        # 与 datasketch 相同的通用哈希: (a*x + b) mod p，取低32位；uint64 溢出回绕是预期行为
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0)
+
+    def add(self, text: str) -> int | None:
+        """
+        加入一段文本。若与已保留的某段文本近似重复，返回那段文本的序号 (本段应被丢弃/合并)；
+        否则保留本段并返回 None。保留文本的序号按保留顺序从0开始。
+        """
+        self.stats.total += 1
+        self.stats.chars_before += len(text)
+
+        # 完全重复用 SHA-1 摘要判定，32位校验和在大量文本块下会碰撞
+        exact_key = hashlib.sha1(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).digest()
+        if exact_key in self._exact:
+            self.stats.exact_duplicates += 1
+            return self._exact[exact_key]
+
+        signature = self.signature(text)
+        band_keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = {index for band, key in enumerate(band_keys) for index in self._buckets[band].get(key, ())}
+        for index in sorted(candidates):
+            if np.mean(self._signatures[index] == signature) >= self.threshold:
+                self.stats.near_duplicates += 1
+                return index
+
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        self._exact[exact_key] = index
+        for band, key in enumerate(band_keys):
+            self._buckets[band][key].append(index)
+        self.stats.kept += 1
+        self.stats.chars_after += len(text)
+        return None
+
+
+def deduplicate_chunks(chunks, threshold: float = 0.8):
+    """
+    对 LangChain Document 列表去重，保留每组近重复块中最先出现的一块，
+    并把被合并块的来源记录到保留块的元数据中 (duplicate_count / duplicate_sources)。
+    返回 (保留的块, DedupStats)。
+    """
+    dedup_filter = NearDuplicateFilter(threshold=threshold)
+    kept = []
+    for chunk in chunks:
+        duplicate_of = dedup_filter.add(chunk.page_content)
+        if duplicate_of is None:
+            kept.append(chunk)
+            continue
+        # 合并：保留块记录重复次数和重复块的来源，元数据值需为标量以便写入 Chroma
+        target = kept[duplicate_of].metadata
+        target["duplicate_count"] = target.get("duplicate_count", 0) + 1
+        source = str(chunk.metadata.get("source", ""))
+        sources = target.get("duplicate_sources", "")
+        if source and source not in sources.split(";"):
+            target["duplicate_sources"] = f"{sources};{source}" if sources else source
+    return kept, dedup_filter.stats
@@ -1,6 +1,7 @@
 # backend/utils/ingest.py (更新后的版本)
 
 import os
+import argparse
 from pathlib import Path
 from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
@@ -17,14 +18,18 @@ BACKEND_DIR = Path(__file__).resolve().parent.parent
 KNOWLEDGE_BASE_DIR = BACKEND_DIR / "knowledge_base"
 CHROMA_COLLECTION_NAME = "local_knowledge_base"
 SENTENCE_MODEL = 'all-MiniLM-L6-v2'
+# 近重复去重的相似度阈值 (估计的 Jaccard 相似度)，同一PDF的多个修订版本会产生大量近似相同的小块
+DEDUP_THRESHOLD = 0.8
 
 # 将项目根目录添加到Python的搜索路径中，以解决潜在的导入问题
 sys.path.append(str(BACKEND_DIR.parent))
 
+from backend.utils.dedup import deduplicate_chunks
+
 print("--- 开始注入本地知识库 ---")
 print(f"知识库目录: {KNOWLEDGE_BASE_DIR}")
 
-def main():
+def main(dedup_threshold: float | None = DEDUP_THRESHOLD):
     # 1. 加载所有文档
     print(f"正在从 '{KNOWLEDGE_BASE_DIR}' 目录加载文档...")
     if not KNOWLEDGE_BASE_DIR.exists():
@@ -50,6 +55,12 @@ def main():
     chunks = text_splitter.split_documents(documents)
     print(f"文档被分割为 {len(chunks)} 个小块。")
 
+    # 2.5 去除近重复的小块 (MinHash + LSH)，重复块的来源合并到保留块的元数据中
+    if dedup_threshold is not None:
+        print(f"正在去除近重复小块 (阈值: {dedup_threshold})...")
+        chunks, dedup_stats = deduplicate_chunks(chunks, threshold=dedup_threshold)
+        print(dedup_stats.summary())
+
     # 3. 创建向量并存入 ChromaDB
     print("正在加载向量模型并创建向量...")
     try:
@@ -70,4 +81,9 @@ def main():
         print(f"❌ 注入过程中发生错误: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="将本地文档注入知识库")
+    parser.add_argument("--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+                        help="近重复判定的相似度阈值 (0~1)，越低去重越激进")
+    parser.add_argument("--no-dedup", action="store_true", help="跳过近重复去重")
+    args = parser.parse_args()
+    main(dedup_threshold=None if args.no_dedup else args.dedup_threshold)
\ No newline at end of file
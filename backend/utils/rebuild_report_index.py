@@ -0,0 +1,77 @@
+# backend/utils/rebuild_report_index.py
+# 根据SQL数据库中已保存的报告重建报告相似度索引 (对原始主题重新编码)。
+# 切换 REPORT_INDEX_BACKEND 后，新后端起初是空的；服务启动时会在索引为空时自动回填，
+# 也可以手动全量重建: python -m backend.utils.rebuild_report_index
+
+import sys
+from contextlib import nullcontext
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BACKEND_DIR.parent))
+
+from backend.config.config import BASE_DIR, settings
+from backend.database import models
+from backend.database.connection import SessionLocal
+from backend.database.vector_index import MmapVectorIndex
+
+SENTENCE_MODEL = 'all-MiniLM-L6-v2'
+BATCH_SIZE = 1000
+
+
+def open_reports_collection(chroma_client, sentence_model):
+    """按 REPORT_INDEX_BACKEND 返回报告相似度索引，两种后端接口一致。"""
+    if settings.REPORT_INDEX_BACKEND == "mmap":
+        return MmapVectorIndex(
+            BASE_DIR / ".report_index",
+            dim=sentence_model.get_sentence_embedding_dimension(),
+            compact_ratio=settings.REPORT_INDEX_COMPACT_RATIO,
+        )
+    return chroma_client.get_or_create_collection(name="reports_collection")
+
+
+def rebuild_report_index(collection, sentence_model, only_if_empty: bool = False) -> int:
+    """
+    把数据库中所有报告的原始主题重新编码并写入索引 (同一ID覆盖写入)，返回写入的报告数。
+    only_if_empty 为 True 时只在索引为空时回填。
+    """
+    # 多个工作进程同时启动时，持有索引的排他锁，保证只有一个进程执行回填
+    lock = collection.write_lock() if isinstance(collection, MmapVectorIndex) else nullcontext()
+    db = SessionLocal()
+    try:
+        with lock:
+            return _rebuild(db, collection, sentence_model, only_if_empty)
+    finally:
+        db.close()
+
+
+def _rebuild(db, collection, sentence_model, only_if_empty: bool) -> int:
+    if only_if_empty and collection.count() > 0:
+        return 0
+    reports = db.query(models.DbReport).order_by(models.DbReport.id).all()
+    for offset in range(0, len(reports), BATCH_SIZE):
+        batch = reports[offset:offset + BATCH_SIZE]
+        embeddings = sentence_model.encode([report.original_topic or "" for report in batch])
+        collection.upsert(
+            embeddings=embeddings.tolist(),
+            metadatas=[{"theme": report.theme, "model_name": report.model_name} for report in batch],
+            ids=[str(report.id) for report in batch],
+        )
+        print(f"已写入 {offset + len(batch)}/{len(reports)} 份报告的向量。")
+    return len(reports)
+
+
+def main():
+    from sentence_transformers import SentenceTransformer
+    import chromadb
+
+    sentence_model = SentenceTransformer(SENTENCE_MODEL, cache_folder=str(BASE_DIR / '.cache'))
+    chroma_client = chromadb.PersistentClient(path=str(BASE_DIR / ".chroma_db"))
+    collection = open_reports_collection(chroma_client, sentence_model)
+    print(f"正在重建报告相似度索引 (后端: {settings.REPORT_INDEX_BACKEND})...")
+    count = rebuild_report_index(collection, sentence_model)
+    print(f"--- 重建完成，共 {count} 份报告 ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,8 @@ function App() {
     { role: 'assistant', content: '您好！请选择一个模型，然后提出您想分析的主题。' }
   ]);
   // ^^^^                                  ^^^^
+  // 服务端对话会话ID，与 messages 一起提升，切换页面后仍沿用同一会话
+  const [chatSessionId, setChatSessionId] = useState(null);
 
   return (
     <div>
@@ -24,7 +26,7 @@ function App() {
           {/* vvvv 将状态和更新函数作为 props 传递下去 vvvv */}
           <Route 
             path="/" 
-            element={<ChatInterface messages={messages} setMessages={setMessages} />} 
+            element={<ChatInterface messages={messages} setMessages={setMessages} chatSessionId={chatSessionId} setChatSessionId={setChatSessionId} />} 
           />
           {/* ^^^^                                       ^^^^ */}
           <Route path="/history" element={<HistoryPage />} />
@@ -4,12 +4,13 @@ import React, { useState, useRef, useEffect } from 'react';
 import ReactMarkdown from 'react-markdown';
 import axios from 'axios';
 import MultiReportViewer from './MultiReportViewer';
+import { streamMixedReports } from './utils/reportStream';
 import './ChatInterface.css';
 
 const API_URL = 'http://127.0.0.1:8000';
 
-// 从父组件 App.jsx 接收 messages 和 setMessages，以实现状态保持
-function ChatInterface({ messages, setMessages }) {
+// 从父组件 App.jsx 接收 messages、setMessages 和服务端会话ID，以实现状态保持
+function ChatInterface({ messages, setMessages, chatSessionId, setChatSessionId }) {
     // 本组件私有的状态
     const [input, setInput] = useState('');
     const [isLoading, setIsLoading] = useState(false);
@@ -35,33 +36,49 @@ function ChatInterface({ messages, setMessages }) {
 
         if (selectedModel === 'mixed-mode') {
             try {
-                let response;
-                // 根据有无模板文件，决定调用哪个API
+                let fetchOptions;
+                let streamUrl;
+                // 根据有无模板文件，决定调用哪个流式API
                 if (templateFile) {
                     console.log("执行带模板的混合模式生成...");
                     const formData = new FormData();
                     formData.append('topic', topicForApi);
                     formData.append('template_file', templateFile);
-                    response = await axios.post(`${API_URL}/api/reports/generate-from-template`, formData, {
-                        headers: { 'Content-Type': 'multipart/form-data' }
-                    });
+                    streamUrl = `${API_URL}/api/reports/generate-from-template/stream`;
+                    fetchOptions = { method: 'POST', body: formData };
                 } else {
                     console.log("执行无模板的混合模式生成...");
-                    response = await axios.post(`${API_URL}/api/reports/generate-mixed`, {
-                        topic: topicForApi,
-                    });
+                    streamUrl = `${API_URL}/api/reports/generate-mixed/stream`;
+                    fetchOptions = {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ topic: topicForApi }),
+                    };
                 }
-                
-                setMessages(prev => [...prev, {
-                    role: 'assistant',
-                    content: response.data.reports,
-                    isMultiReport: true,
-                    topic: topicForApi
-                }]);
+
+                // 收到第一批事件时插入多报告消息，之后随着流式事件逐步更新其内容
+                let inserted = false;
+                await streamMixedReports(streamUrl, fetchOptions, (reports, runId) => {
+                    if (!inserted) {
+                        inserted = true;
+                        setMessages(prev => [...prev, {
+                            role: 'assistant',
+                            content: reports,
+                            isMultiReport: true,
+                            topic: topicForApi,
+                            runId: runId
+                        }]);
+                        return;
+                    }
+                    setMessages(prev => {
+                        const lastMessage = prev[prev.length - 1];
+                        return [...prev.slice(0, -1), { ...lastMessage, content: reports }];
+                    });
+                });
                 
             } catch (error) {
                 console.error('混合模式生成报告时出错:', error);
-                const errorMsg = error.response?.data?.detail || '抱歉，混合模式生成失败。';
+                const errorMsg = error.message || '抱歉，混合模式生成失败。';
                 setMessages(prev => [...prev, { role: 'assistant', content: errorMsg }]);
             } finally {
                 setIsLoading(false);
@@ -71,25 +88,38 @@ function ChatInterface({ messages, setMessages }) {
         } else {
             // 单模型对话逻辑 (流式)
             try {
-                // 在发送API请求前，净化消息历史
-                const apiMessages = messagesForApi.map(msg => {
-                    if (msg.isMultiReport) {
-                        return { 
-                            role: 'assistant', 
-                            content: `(系统提示：用户已针对主题“${msg.topic}”生成并查看了一份多模型报告)` 
-                        };
-                    }
-                    return { role: msg.role, content: msg.content };
-                });
+                // 历史记录保存在服务端会话中，首次对话时创建会话，之后每轮只发送新消息
+                let sessionId = chatSessionId;
+                if (!sessionId) {
+                    const sessionResponse = await axios.post(`${API_URL}/api/chat/sessions`, { model: selectedModel });
+                    sessionId = sessionResponse.data.session_id;
+                    setChatSessionId(sessionId);
+                }
+                const newMessage = messagesForApi[messagesForApi.length - 1];
+                // 混合模式的主题和报告不经过会话，随本轮消息一起补写进会话，多报告消息替换为一条提示
+                const history = messagesForApi.slice(1, -1)
+                    .filter(msg => !msg.inSession && !msg.localOnly && msg.content)
+                    .map(msg => {
+                        if (msg.isMultiReport) {
+                            return {
+                                role: 'assistant',
+                                content: `(系统提示：用户已针对主题“${msg.topic}”生成并查看了一份多模型报告)`
+                            };
+                        }
+                        return { role: msg.role, content: msg.content };
+                    });
 
                 setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
-                const response = await fetch(`${API_URL}/api/chat/completions`, {
+                const response = await fetch(`${API_URL}/api/chat/sessions/${sessionId}/messages`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ messages: apiMessages, model: selectedModel }),
+                    body: JSON.stringify({ content: newMessage.content, model: selectedModel, history }),
                 });
 
+                if (!response.ok) throw new Error(`请求失败: ${response.status}`);
                 if (!response.body) throw new Error("Response body is empty.");
+                // 服务端已写入补发的轮次和本轮消息，标记为已在会话中，之后不再重复发送
+                setMessages(prev => prev.map(msg => (msg.inSession ? msg : { ...msg, inSession: true })));
                 
                 const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
                 while (true) {
@@ -103,7 +133,7 @@ function ChatInterface({ messages, setMessages }) {
                 }
             } catch (error) {
                 console.error('Error fetching stream:', error);
-                setMessages(prev => [...prev, { role: 'assistant', content: '抱歉，连接时出现问题。' }]);
+                setMessages(prev => [...prev, { role: 'assistant', content: '抱歉，连接时出现问题。', localOnly: true }]);
             } finally {
                 setIsLoading(false);
             }
@@ -125,7 +155,10 @@ function ChatInterface({ messages, setMessages }) {
         setIsLoading(true);
 
         try {
-            const simResponse = await axios.post(`${API_URL}/api/find-similar`, { topic: submittedInput });
+            const simResponse = await axios.post(`${API_URL}/api/find-similar`, {
+                topic: submittedInput,
+                prewarm: selectedModel === 'mixed-mode',
+            });
             if (simResponse.data && simResponse.data.length > 0) {
                 setSimilarReports(simResponse.data);
                 setShowSimilar(true);
@@ -148,6 +181,11 @@ function ChatInterface({ messages, setMessages }) {
         await generateResponse(messages, originalTopic, templateFile);
     };
 
+    // 重试失败的模型后，用后端返回的完整结果替换对应消息中的报告
+    const updateMultiReport = (messageIndex, reports) => {
+        setMessages(prev => prev.map((msg, i) => (i === messageIndex ? { ...msg, content: reports } : msg)));
+    };
+
     const handleFileChange = (event) => {
         const file = event.target.files[0];
         if (file && file.name.endsWith('.docx')) {
@@ -176,7 +214,12 @@ function ChatInterface({ messages, setMessages }) {
                     <div key={index} className={`message ${msg.role}`}>
                         <div className="message-content">
                             {msg.isMultiReport ? (
-                                <MultiReportViewer reports={msg.content} topic={msg.topic} />
+                                <MultiReportViewer
+                                    reports={msg.content}
+                                    topic={msg.topic}
+                                    runId={msg.runId}
+                                    onReportsUpdate={(reports) => updateMultiReport(index + 1, reports)}
+                                />
                             ) : (
                                 <ReactMarkdown>{msg.content}</ReactMarkdown>
                             )}
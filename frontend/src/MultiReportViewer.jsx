@@ -7,14 +7,34 @@ import { downloadMarkdownFile } from './utils/downloader'; // 导入下载工具
 
 const API_URL = 'http://127.0.0.1:8000';
 
-// 组件现在接收 reports 和 topic 两个 props
-function MultiReportViewer({ reports, topic }) {
+// 组件接收 reports、topic，以及用于重试失败模型的 runId 和 onReportsUpdate
+function MultiReportViewer({ reports, topic, runId, onReportsUpdate }) {
     const [activeTab, setActiveTab] = useState(0);
+    const [retrying, setRetrying] = useState(false);
 
     if (!reports || reports.length === 0) {
-        return <div>没有可展示的报告。</div>;
+        return <div>正在生成报告...</div>;
     }
 
+    // 流式生成尚未结束的报告不允许保存或下载
+    const isStreaming = reports[activeTab]?.status === 'streaming';
+    const hasFailed = reports.some(report => report.status === 'error');
+    // 仍有模型在生成时不能重试，否则会在同一检查点上并发执行
+    const anyStreaming = reports.some(report => report.status === 'streaming');
+
+    // --- 新增：只重试失败的模型，已成功的模型复用后端检查点中的结果 ---
+    const handleRetry = async () => {
+        setRetrying(true);
+        try {
+            const response = await axios.post(`${API_URL}/api/reports/runs/${runId}/retry`);
+            onReportsUpdate(response.data.reports);
+        } catch (error) {
+            console.error('重试失败的模型时出错:', error);
+            alert('重试失败！');
+        }
+        setRetrying(false);
+    };
+
     // --- 新增：保存报告的函数 ---
     const handleSave = async () => {
         const reportToSave = reports[activeTab];
@@ -56,7 +76,7 @@ function MultiReportViewer({ reports, topic }) {
                             borderBottom: activeTab === index ? '3px solid #007bff' : '3px solid transparent',
                         }}
                     >
-                        {report.model_name}
+                        {report.model_name}{report.status === 'streaming' ? ' (生成中...)' : ''}
                     </button>
                 ))}
             </div>
@@ -68,16 +88,27 @@ function MultiReportViewer({ reports, topic }) {
             <div style={{ marginTop: '20px', borderTop: '1px solid #eee', paddingTop: '15px' }}>
                 <button
                     onClick={handleSave}
+                    disabled={isStreaming}
                     style={{ padding: '8px 16px', background: '#28a745', color: 'white', border: 'none', borderRadius: '5px', cursor: 'pointer', fontSize: '14px' }}
                 >
                     采用此方案并保存
                 </button>
                 <button
                     onClick={handleDownload}
+                    disabled={isStreaming}
                     style={{ marginLeft: '10px', padding: '8px 16px', background: '#007bff', color: 'white', border: 'none', borderRadius: '5px', cursor: 'pointer', fontSize: '14px' }}
                 >
                     下载此版本
                 </button>
+                {hasFailed && !anyStreaming && runId && onReportsUpdate && (
+                    <button
+                        onClick={handleRetry}
+                        disabled={retrying}
+                        style={{ marginLeft: '10px', padding: '8px 16px', background: '#dc3545', color: 'white', border: 'none', borderRadius: '5px', cursor: 'pointer', fontSize: '14px' }}
+                    >
+                        {retrying ? '重试中...' : '重试失败的模型'}
+                    </button>
+                )}
             </div>
         </div>
     );
@@ -0,0 +1,86 @@
+// frontend/src/utils/reportStream.js
+
+/**
+ * 将流式接收到的部分报告拼接为 Markdown，格式与后端 convert_report_to_markdown 保持一致。
+ * @param {object} partial - 已接收的部分报告 { title, introduction, sections }。
+ * @returns {string}
+ */
+function partialReportToMarkdown(partial) {
+  let md = '';
+  if (partial.title) md += `# ${partial.title}\n\n`;
+  if (partial.introduction) md += `## 引言\n${partial.introduction}\n\n`;
+  for (const section of partial.sections.filter(Boolean)) {
+    md += `## ${section.section_title}\n${section.section_content}\n\n`;
+  }
+  return md + '*正在生成后续内容...*';
+}
+
+/**
+ * 调用混合模式的流式接口，逐步组装各模型的报告。
+ * @param {string} url - 流式接口地址。
+ * @param {object} fetchOptions - 传给 fetch 的请求参数。
+ * @param {function} onUpdate - 每次有新内容时回调，参数为 ([{ model_name, content, status }], runId)。
+ */
+export async function streamMixedReports(url, fetchOptions, onUpdate) {
+  const response = await fetch(url, fetchOptions);
+  if (!response.ok) {
+    const error = await response.json().catch(() => ({}));
+    throw new Error(error.detail || `请求失败: ${response.status}`);
+  }
+  if (!response.body) throw new Error('Response body is empty.');
+
+  // 按模型名称保存各自的部分报告，保持模型顺序不变
+  const partials = new Map();
+  // 后端为本次运行分配的ID，可用于重试失败的模型
+  let runId = null;
+  const ensurePartial = (modelName) => {
+    if (!partials.has(modelName)) {
+      partials.set(modelName, { sections: [], status: 'streaming', content: null });
+    }
+    return partials.get(modelName);
+  };
+  const emit = () => {
+    onUpdate(Array.from(partials.entries()).map(([modelName, partial]) => ({
+      model_name: modelName,
+      status: partial.status,
+      content: partial.content ?? partialReportToMarkdown(partial),
+    })), runId);
+  };
+
+  const handleEvent = (event) => {
+    if (event.event === 'start') {
+      runId = event.run_id;
+      event.models.forEach(ensurePartial);
+      emit();
+      return;
+    }
+    const partial = ensurePartial(event.model_name);
+    if (event.event === 'title' || event.event === 'introduction') {
+      partial[event.event] = event.data;
+    } else if (event.event === 'section') {
+      partial.sections[event.index] = event.data;
+    } else if (event.event === 'done' || event.event === 'error') {
+      partial.status = event.event;
+      partial.content = event.content;
+    }
+    emit();
+  };
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += value;
+    // SSE 事件之间以空行分隔，最后一段可能尚未接收完整
+    const blocks = buffer.split('\n\n');
+    buffer = blocks.pop();
+    for (const block of blocks) {
+      const data = block.split('\n')
+        .filter(line => line.startsWith('data: '))
+        .map(line => line.slice(6))
+        .join('\n');
+      if (data) handleEvent(JSON.parse(data));
+    }
+  }
+}